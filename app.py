@@ -1,363 +1,721 @@
 # app.py
 import os
-import psycopg2
-from psycopg2.extras import DictCursor
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from datetime import datetime, date, timedelta
-from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
+import csv
+import hashlib
+import io
+import json
+import mimetypes
+import bisect
+import random
+import re
+import secrets
+import threading
+import time
+import zipfile
+from flask import Flask, Request, Response, render_template, request, redirect, url_for, session, flash, g, jsonify, make_response, send_from_directory, stream_with_context
+from datetime import datetime
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.middleware.proxy_fix import ProxyFix
+import assets
+import db
+import events
+import fragments
+import metrics
+import migrate
+import passwords
+import season
+import storage
+import thumbnails
 
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'pdf', 'txt', 'webp', 'heic', 'heif'}
+UPLOAD_MAX_MB = int(os.environ.get('UPLOAD_MAX_MB', 20))
+
+class UploadRequest(Request):
+    # Файлы из формы пишутся кусками сразу во временную папку хранилища с подсчётом хеша
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return storage.get_storage().staging_file(max_size=UPLOAD_MAX_MB * 1024 * 1024)
 
 app = Flask(__name__)
+app.request_class = UploadRequest
+# Число доверенных прокси перед приложением: на Render — 1, локально — 0
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', 0))
+# Как часто календарь без потока /events спрашивает счёт (секунды)
+CALENDAR_POLL_INTERVAL = int(os.environ.get('CALENDAR_POLL_INTERVAL', 30))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
 app.secret_key = 'supersecretkey'
+metrics.init_app(app)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Запас сверх лимита файла — на остальные поля формы; больший запрос отклоняется до чтения тела
+app.config['MAX_CONTENT_LENGTH'] = (UPLOAD_MAX_MB + 1) * 1024 * 1024
 # Создать папку для загрузки, если её нет
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
 def get_db():
-    if 'DATABASE_URL' in os.environ:
-        # На Render или Heroku — PostgreSQL
-        conn = psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=DictCursor)
-        conn.set_session(autocommit=True)
-    else:
-        # Локально — SQLite
-        import sqlite3
-        conn = sqlite3.connect('database.db', timeout=20)
-        conn.row_factory = sqlite3.Row
-        conn.execute('PRAGMA journal_mode=WAL;')
-    return conn
-
-# --- Инициализация БД ---
-def init_db():
-    if 'DATABASE_URL' in os.environ:
-        # Работаем с PostgreSQL
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cursor = conn.cursor()
-
-        # Создание таблиц
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                is_admin INTEGER DEFAULT 0
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS progress (
-                user_id INTEGER,
-                day INTEGER,
-                opened_at TIMESTAMP,
-                PRIMARY KEY (user_id, day)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS tasks (
-                day INTEGER PRIMARY KEY,
-                title TEXT NOT NULL,
-                content TEXT,
-                hint TEXT,
-                image_url TEXT,
-                video_url TEXT,
-                is_published INTEGER DEFAULT 0,
-                points_free INTEGER DEFAULT 0,
-                points_global INTEGER DEFAULT 0,
-                is_paid INTEGER DEFAULT 0,
-                response_type TEXT DEFAULT 'file'
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS points (
-                user_id INTEGER PRIMARY KEY,
-                free_points INTEGER DEFAULT 0,
-                paid_points INTEGER DEFAULT 0
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS submissions_day (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER,
-                day INTEGER,
-                file_url TEXT,
-                text_response TEXT,
-                submitted_at TIMESTAMP,
-                status TEXT DEFAULT 'pending'
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS rewards (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER,
-                reward_type TEXT,
-                awarded_at TIMESTAMP
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS global_progress (
-                id INTEGER PRIMARY KEY CHECK (id = 1),
-                total_points INTEGER DEFAULT 0
-            )
-        ''')
-
-        # Вставка начального значения
-        cursor.execute('''
-            INSERT INTO global_progress (id, total_points)
-            VALUES (1, 0)
-            ON CONFLICT (id) DO NOTHING
-        ''')
-
-        # Примеры заданий
-        sample_tasks = [
-            (1, 'Вопросики', 'Ответьте на вопросы:<br>Сколько видео было найдено в старых записях?<br>Какое словосочетание появилось в видео после нахождения секретного пароля?<br>В какое время нужно было подойти в место из записки?<br>Кто пришел на встречу?<br>Сколько раз было написано 17?<br>Где находилась старая библеотека?<br>Как звали помошника мистера Харриса?<br>Какое слово получилось в кроссворде?<br>Какие места попросил сфотографировать мистер Харрис?<br>Где находились детективы все это время?', 'Вспомните 1 квест.', None, None, 1, 30, 5, 0, 'text'),
-            (2, 'Письмо', 'Напишите письмо деду морозу.', 'Он существует!', None, None, 1, 20, 5, 0, 'text'),
-            (3, 'Основной канал', 'Подпишитесь на канал компании.', 'Спасибо от SMOKE!TYT', None, None, 1, 25, 5, 0, 'file'),
-            (4, 'Рисование', 'Нарисуйте новогоднюю елочку.', 'Главное от души.', None, None, 1, 15, 5, 0, 'file'),
-            (5, 'Сплетни', 'Расскажите 3-м друзьям об этом квесте, если заинтересует, то писать менеджеру.', 'Говорите убедительно. Особенно про подарки.', None, None, 1, 50, 5, 0, 'file'),
-            (6, 'О, заказик', 'Сделайте заказ в магазине (любой).', 'Даже самое дешевое.', None, None, 1, 0, 5, 100, 'file'),
-            (7, 'Что ждете?', 'Какие у вас ожидания от ближайшего теста продукции?', 'Говорите честно.', None, None, 1, 30, 5, 0, 'text'),
-            (8, 'Запомнили?', 'Напишите о самом запоминающемся событии за 2025.', 'Интересное событие.', None, None, 1, 15, 5, 0, 'text'),
-            (9, 'Пусть сбудется!', 'Какой вы видите (или хотели бы видеть) нашу компанию в 2026?', 'Мы учтем ваши пожелания.', None, None, 1, 30, 5, 0, 'text'),
-            (10, 'С Новым Годом!', 'Поздравьте с НГ Харриса. По этой ссылке: https://t.me/tribute/app?startapp=dBTh', 'Ему будет приятно, а для вас в конце все старания окупяться.', None, None, 1, 0, 0, 150, 'file'),
-            (11, 'Элиза?', 'Ваше мнение, кто такая Элиза?', 'Она живая.', None, None, 1, 30, 5, 0, 'text'),
-            (12, 'Мама - это святое', 'Сделайте открытку - поздравление с наступающим Новым годом своими руками и подарите маме.', 'Маме будет приятно.', None, None, 1, 25, 5, 0, 'file'),
-            (13, 'Разгадай-ка', 'Разгадайте загадку и напишите ответ.<br>Мы двигались дальше и дальше<br>Но с каждым шагом встречали его<br>Куда не пойдем везде тут как тут<br>Прошли первый квест уже давно<br>И чаще его не встречали ничто<br>Что это?', 'Ответ проще, чем вы думаете.', None, None, 1, 15, 5, 0, 'text'),
-            (14, 'С Новым Годом!', 'Поздравьте с НГ Эдварда. По этой ссылке: https://t.me/tribute/app?startapp=dBTi', 'Ему будет приятно, а для вас в конце все старания окупяться.', None, None, 1, 0, 5, 150, 'file'),
-            (15, 'Подписочка', 'Подпишитесь на канал. https://t.me/tearswhale', 'Давайте поддержим музыканта.', None, None, 1, 30, 5, 0, 'file'),
-            (16, 'С Новым Годом!', 'Напишите поздравление команде.', 'Нам будет приятно почитать ваши поздравления.', None, None, 1, 30, 5, 0, 'text'),
-            (17, 'С Новым Годом!', 'Поздравьте с НГ команду. По этой ссылке: https://t.me/tribute/app?startapp=dBTj', 'Нам будет приятно, а для вас в конце все старания окупяться.', None, None, 1, 0, 5, 150, 'file'),
-            (18, 'А это вам', 'Вот и наступил 2026 год! В этот день, от всей команды хотели бы пожелать тебе здоровья, счастья и мира в этом году. Очень надеемся, что наш путь за этот год станет куда интереснее и насыщеннее. Мы будем очень стараться радовать тебя новой продукцией и улучшениями старой. Спасибо, что ты с нами прошел весь прошлый год, начиная с первого квеста и по сегодняшний день. Честно, мы очень ценим и гордимся, что работаем вместе. Да, именно работаем, так как благодаря тому, что у нас есть вы, наши бета-тестеры, нам есть для кого делать тестовые партии и получать реальные и честные отзывы, даже если они и не очень хорошие. Еще раз спасибо!!! С Новым Годом!!! Примите поздравления от всей команды SMOKE!TYT', 'С Новым Годом!', None, None, 1, 26, 5, 0, 'text'),
-            (19, 'Под одеяльцом', 'Посмотрите Новогодний фильм. Напишите свой отзыв о нем.', 'Только не "Один дома".', None, None, 1, 15, 5, 0, 'text'),
-            (20, 'Вкуснота', 'Напишите о своём любимом новогоднем блюде. Что это? И почему самое любимое?', 'Салатики, закусочки, ммм.', None, None, 1, 15, 5, 0, 'text'),
-            (21, 'Друг или враг?', 'Напишите свое развернутое мнение о Харрисе.', 'Пишите то, что реально думаете.', None, None, 1, 30, 5, 0, 'text'),
-            (22, 'Кто он?', 'Как вы считаете, кто такой на самом деле Эдвард Лимб?', 'Развернутый ответ.', None, None, 1, 30, 5, 0, 'text'),
-            (23, 'Ну мы же старалиииись.', 'Благодарность за квест. По этой ссылке: https://t.me/tribute/app?startapp=dBTk', 'Мы потратили много сил и времени.', None, None, 1, 0, 5, 100, 'text'),
-            (24, 'Елочка', 'Пришлите фото своей новогодней елки.', 'Наряженная.', None, None, 1, 15, 5, 0, 'file'),
-            (25, 'Посчитаем', 'Какой возраст компании?', 'Не месяц.', None, None, 1, 20, 5, 0, 'text'),
-            (26, 'Подарочки', 'Расскажите какие подарки получили на Новый год.', 'Много подарочков?', None, None, 1, 20, 5, 0, 'text'),
-            (27, 'Хорошо?', 'Напишите свое мнение о том, как вы провели новогодние праздники.', 'Куда же без вредного.', None, None, 1, 15, 5, 1, 'text'),
-            (28, 'Здоровая критика', 'Выскажите мнение про творчество.', 'Ему будет интересно услышать честное мнение. https://t.me/tearswhale', None, None, 1, 25, 5, 0, 'text'),
-            (29, 'Надо проснуться', 'Купите кофе, пожалуйста. По этой ссылке: https://t.me/tribute/app?startapp=dBTl', 'В первый день не проснуться.', None, None, 1, 0, 5, 100, 'file'),
-            (30, 'Тяжеловато', 'Расскажите, какого выходить на учебу/работу/другое, после новогодних праздников.', 'Тяжело, согласны.', None, None, 1, 20, 5, 0, 'text'),
-            (31, 'Добиваем подарочки', 'Получи дополнительные баллы (чем больше донат, тем больше баллов, отличная возможность под конец добить баллы). 1 балл, за каждые 2₽.', 'Не упускайте возможность забрать максимальные призы.', None, None, 1, 0, 0, 0, 'file'),
-        ]
-
-        for task in sample_tasks:
-            cursor.execute('''
-                INSERT INTO tasks 
-                (day, title, content, hint, image_url, video_url, is_published, points_free, points_global, is_paid, response_type)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (day) DO UPDATE SET
-                title = EXCLUDED.title,
-                content = EXCLUDED.content
-            ''', task)
-
-        # Админ
-        cursor.execute('''
-            INSERT INTO users (username, password, is_admin)
-            VALUES ('admin', %s, 1)
-            ON CONFLICT (username) DO NOTHING
-        ''', (generate_password_hash('22551bdg'),))
-
-        conn.commit()
-        conn.close()
-
-    else:
-        # Локально — SQLite (как раньше)
-        with sqlite3.connect('database.db') as conn:
-            conn.execute('PRAGMA journal_mode=WAL;')
-            cursor = conn.cursor()
+    # Одно соединение на запрос: берётся из пула при первом обращении и возвращается в teardown
+    # На Render или Heroku — PostgreSQL, без DATABASE_URL — встроенная SQLite
+    if 'db' not in g:
+        started = time.perf_counter()
+        g.db = db.get_pool().getconn()
+        metrics.record('conn', time.perf_counter() - started)
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db.get_pool().putconn(conn)
 
 # --- Функции ---
-def get_global_points():
-    conn = get_db()
-    try:
-        cursor = conn.cursor()
-        cursor.execute('SELECT total_points FROM global_progress WHERE id = 1')
-        row = cursor.fetchone()
-        return row['total_points'] if row else 0
-    finally:
-        conn.close()
+GLOBAL_POINTS_CAP = 2026
+GLOBAL_POINTS_SHARDS = int(os.environ.get('GLOBAL_POINTS_SHARDS', 8))
+GLOBAL_POINTS_CACHE_TTL = float(os.environ.get('GLOBAL_POINTS_CACHE_TTL', 2))
+# (истекает в, значение) — короткий кеш суммы полос для чтения
+_global_points_cache = (0.0, 0)
+
+def get_global_points(conn=None, fresh=False):
+    global _global_points_cache
+    expires_at, value = _global_points_cache
+    if not fresh and time.monotonic() < expires_at:
+        return value
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute(
+        'SELECT LEAST(%s, COALESCE(SUM(total_points), 0)) AS total_points FROM global_progress_shards',
+        (GLOBAL_POINTS_CAP,)
+    )
+    value = cursor.fetchone()['total_points']
+    _global_points_cache = (time.monotonic() + GLOBAL_POINTS_CACHE_TTL, value)
+    return value
 
-def get_user_points(user_id):
+def get_user_points(user_id, conn=None):
     if not user_id:
         return 0, 0
-    conn = get_db()
-    try:
-        cursor = conn.cursor()
-        cursor.execute('SELECT free_points, paid_points FROM points WHERE user_id = %s', (user_id,))
-        row = cursor.fetchone()
-        return (row['free_points'], row['paid_points']) if row else (0, 0)
-    finally:
-        conn.close()
-
-def add_points(user_id, free_points, paid_points):
-    conn = get_db()
-    try:
-        cursor = conn.cursor()
-        cursor.execute('SELECT free_points, paid_points FROM points WHERE user_id = %s', (user_id,))
-        row = cursor.fetchone()
-        if row:
-            current_free, current_paid = row['free_points'], row['paid_points']
-        else:
-            current_free, current_paid = 0, 0
-
-        new_free = min(1015, current_free + free_points)
-        new_paid = min(1001, current_paid + paid_points)
-
-        cursor.execute('''
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT free_points, paid_points FROM points WHERE user_id = %s', (user_id,))
+    row = cursor.fetchone()
+    return (row['free_points'], row['paid_points']) if row else (0, 0)
+
+FREE_POINTS_CAP = 1015
+PAID_POINTS_CAP = 1001
+
+def credit_points(entries, conn=None):
+    # entries: (user_id, free, paid, submission_id, reason). Журнал — одним INSERT,
+    # балансы — одним атомарным upsert на всех пользователей пачки.
+    if not entries:
+        return {}
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+
+    deltas = {}
+    for user_id, free_points, paid_points, _, _ in entries:
+        free, paid = deltas.get(user_id, (0, 0))
+        deltas[user_id] = (free + free_points, paid + paid_points)
+
+    with db.transaction(conn):
+        values, params = db.values_list(entries)
+        cursor.execute(f'''
+            INSERT INTO points_ledger (user_id, free_delta, paid_delta, submission_id, reason)
+            VALUES {values}
+        ''', params)
+
+        # Баланс меняется одним атомарным выражением — без чтения и потерянных обновлений
+        values, params = db.values_list(
+            [(user_id, FREE_POINTS_CAP, free, PAID_POINTS_CAP, paid) for user_id, (free, paid) in deltas.items()],
+            '(%s, LEAST(%s, %s), LEAST(%s, %s))'
+        )
+        cursor.execute(f'''
             INSERT INTO points (user_id, free_points, paid_points)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (user_id) DO UPDATE
-            SET free_points = EXCLUDED.free_points, paid_points = EXCLUDED.paid_points
-        ''', (user_id, new_free, new_paid))
-        conn.commit()
-
-        check_rewards(user_id, conn)
-    finally:
-        conn.close()
+            VALUES {values}
+            ON CONFLICT (user_id) DO UPDATE SET
+                free_points = LEAST(%s, points.free_points + EXCLUDED.free_points),
+                paid_points = LEAST(%s, points.paid_points + EXCLUDED.paid_points)
+            RETURNING user_id, free_points, paid_points
+        ''', (*params, FREE_POINTS_CAP, PAID_POINTS_CAP))
+        balances = {row['user_id']: (row['free_points'], row['paid_points']) for row in cursor.fetchall()}
+        set_user_totals(balances, conn)
+
+        # Проверяем только пороги между старым и новым балансом
+        grant_personal_rewards([
+            (user_id, free + paid - sum(deltas[user_id]), free + paid)
+            for user_id, (free, paid) in balances.items()
+        ], conn)
+    return balances
+
+def add_points(user_id, free_points, paid_points, conn=None, submission_id=None, reason=None):
+    balances = credit_points([(user_id, free_points, paid_points, submission_id, reason)], conn)
+    return balances[user_id]
+
+def rebuild_points_balances(conn=None):
+    # Пересчёт балансов из журнала с теми же потолками, что и при начислении
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+    with db.transaction(conn):
+        # Журнал читается в той же транзакции, что и перезапись балансов: начисление,
+        # пришедшее между чтением и DELETE, иначе пропало бы из points. В PostgreSQL
+        # SHARE-блокировка ждёт идущие начисления и не пускает новые до COMMIT;
+        # в SQLite писателей уже разводит BEGIN IMMEDIATE
+        if db.dialect() == 'postgres':
+            cursor.execute('LOCK TABLE points_ledger IN SHARE MODE')
+        cursor.execute('SELECT user_id, free_delta, paid_delta FROM points_ledger ORDER BY user_id, id')
+        balances = {}
+        for row in cursor.fetchall():
+            free, paid = balances.get(row['user_id'], (0, 0))
+            balances[row['user_id']] = (
+                min(FREE_POINTS_CAP, free + row['free_delta']),
+                min(PAID_POINTS_CAP, paid + row['paid_delta']),
+            )
 
-def add_to_global_points(points):
-    conn = get_db()
-    try:
-        current = get_global_points()  # уже с get_db()
-        new_total = min(2026, current + points)
-        cursor = conn.cursor()
-        cursor.execute('UPDATE global_progress SET total_points = %s WHERE id = 1', (new_total,))
-        conn.commit()
-    finally:
-        conn.close()
+        cursor.execute('DELETE FROM points')
+        cursor.executemany(
+            'INSERT INTO points (user_id, free_points, paid_points) VALUES (%s, %s, %s)',
+            [(user_id, free, paid) for user_id, (free, paid) in balances.items()]
+        )
+        if balances:
+            set_user_totals(balances, conn)
+    return len(balances)
+
+@app.cli.command('rebuild-points')
+def rebuild_points_command():
+    count = rebuild_points_balances()
+    print(f'✅ Балансы пересчитаны из журнала: {count} пользователей')
+
+def add_to_global_points(points, conn=None):
+    # Прибавляем к случайной полосе (строка создаётся при первом начислении);
+    # потолок применяется в самом запросе
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO global_progress_shards (shard, total_points)
+        VALUES (%(shard)s, LEAST(%(points)s, GREATEST(0,
+            %(cap)s - (SELECT COALESCE(SUM(total_points), 0) FROM global_progress_shards))))
+        ON CONFLICT (shard) DO UPDATE
+        SET total_points = global_progress_shards.total_points + EXCLUDED.total_points
+    ''', {
+        'points': points,
+        'cap': GLOBAL_POINTS_CAP,
+        'shard': random.randrange(GLOBAL_POINTS_SHARDS),
+    })
+    new_total = get_global_points(conn, fresh=True)
+    # Внутри транзакции сумма ещё не зафиксирована — пороги сверяет вызывающий после COMMIT
+    if not db.in_transaction(conn):
+        settle_global_milestones(conn)
+    return new_total
+
+# Командные пороги, уже записанные в global_milestones этим процессом
+_settled_milestones = set()
+
+def settle_global_milestones(conn=None):
+    # Пороги сверяются с зафиксированной суммой полос, а не с приростом одного начисления:
+    # два параллельных начисления в разные полосы, вместе перешедшие порог, приз не теряют.
+    # Строку global_milestones вставляет ровно один процесс — он и раздаёт приз всем участникам
+    if conn is None:
+        conn = get_db()
+    reached = [reward_type for reward_type in rewards_reached('global', get_global_points(conn, fresh=True))
+               if reward_type not in _settled_milestones]
+    if not reached:
+        return []
+    cursor = conn.cursor()
+    values, params = db.values_list([(reward_type,) for reward_type in reached], '(%s, NOW())')
+    with db.transaction(conn):
+        cursor.execute(f'''
+            INSERT INTO global_milestones (reward_type, reached_at) VALUES {values}
+            ON CONFLICT (reward_type) DO NOTHING
+            RETURNING reward_type
+        ''', params)
+        granted = [row['reward_type'] for row in cursor.fetchall()]
+        if granted:
+            grant_global_rewards(granted, conn)
+    _settled_milestones.update(reached)
+    return granted
+
+def remove_from_global_points(points, conn=None):
+    # Редкая админская операция: блокируем все полосы и сводим сумму в полосу 0.
+    # FOR UPDATE заблокировал бы только существующие строки, а полосу, вставленную
+    # параллельным начислением, UPDATE бы обнулил — в PostgreSQL блокируется вся таблица
+    # (чтение не ждёт); в SQLite писателей уже разводит BEGIN IMMEDIATE
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+    with db.transaction(conn):
+        if db.dialect() == 'postgres':
+            cursor.execute('LOCK TABLE global_progress_shards IN EXCLUSIVE MODE')
+        cursor.execute('SELECT total_points FROM global_progress_shards')
+        current = min(GLOBAL_POINTS_CAP, sum(row['total_points'] for row in cursor.fetchall()))
+        if points > current:
+            return False, current
+        cursor.execute(
+            'UPDATE global_progress_shards SET total_points = CASE WHEN shard = 0 THEN %s ELSE 0 END',
+            (current - points,)
+        )
+    return True, get_global_points(conn, fresh=True)
+
+REWARD_TARGETS = {
+    'personal': [
+        {'type': 'xalava', 'name': 'Бесплатная позиция в магазине из предложенных', 'points': 555},
+        {'type': 'small', 'name': 'Маленький приз', 'points': 1276},
+        {'type': 'merch', 'name': 'Брелок (мерч)', 'points': 1444},
+        {'type': 'medium', 'name': 'Средний приз', 'points': 1651},
+        {'type': 'dostavka', 'name': 'Бесплатная доставка при получении приза', 'points': 1888},
+        {'type': 'large', 'name': 'Большой приз', 'points': 2026},
+    ],
+    'global': [
+        {'type': 'sale', 'name': 'Б/У Aegis Hero 2 за 999р', 'points': 226},
+        {'type': 'discount', 'name': 'Скидка 50% в магазине', 'points': 777},
+        {'type': 'certificate', 'name': 'Секретный приз', 'points': 1013},
+    ]
+}
+
+# Отсортированные пороги призов: scope -> ([баллы], [тип приза])
+REWARD_THRESHOLDS = {
+    scope: (
+        [r['points'] for r in sorted(targets, key=lambda r: r['points'])],
+        [r['type'] for r in sorted(targets, key=lambda r: r['points'])],
+    )
+    for scope, targets in REWARD_TARGETS.items()
+}
 
 def get_reward_targets():
-    return {
-        'personal': [
-            {'type': 'xalava', 'name': 'Бесплатная позиция в магазине из предложенных', 'points': 555},
-            {'type': 'small', 'name': 'Маленький приз', 'points': 1276},
-            {'type': 'merch', 'name': 'Брелок (мерч)', 'points': 1444},
-            {'type': 'medium', 'name': 'Средний приз', 'points': 1651},
-            {'type': 'dostavka', 'name': 'Бесплатная доставка при получении приза', 'points': 1888},
-            {'type': 'large', 'name': 'Большой приз', 'points': 2026},
+    return REWARD_TARGETS
+
+def rewards_crossed(scope, old_total, new_total):
+    # Призы с порогом в полуинтервале (old_total, new_total]
+    points, types = REWARD_THRESHOLDS[scope]
+    return types[bisect.bisect_right(points, old_total):bisect.bisect_right(points, new_total)]
+
+def rewards_reached(scope, total):
+    points, types = REWARD_THRESHOLDS[scope]
+    return types[:bisect.bisect_right(points, total)]
+
+def grant_personal_rewards(changes, conn=None):
+    # changes: (user_id, старый баланс, новый баланс); все выдачи — одним INSERT
+    granted = [
+        (user_id, reward_type)
+        for user_id, old_total, new_total in changes
+        for reward_type in rewards_crossed('personal', old_total, new_total)
+    ]
+    if not granted:
+        return []
+    if conn is None:
+        conn = get_db()
+    values, params = db.values_list(granted, '(%s, %s, NOW())')
+    conn.cursor().execute(f'''
+        INSERT INTO rewards (user_id, reward_type, awarded_at)
+        VALUES {values}
+        ON CONFLICT (user_id, reward_type) DO NOTHING
+    ''', params)
+    return granted
+
+def grant_global_rewards(reward_types, conn=None, user_id=None):
+    # Одним INSERT ... SELECT на каждый приз: всем участникам или одному пользователю
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+    user_filter = 'AND u.id = %(user_id)s' if user_id is not None else ''
+    for reward_type in reward_types:
+        cursor.execute(f'''
+            INSERT INTO rewards (user_id, reward_type, awarded_at)
+            SELECT u.id, %(reward_type)s, NOW() FROM users u
+            WHERE u.is_admin = 0 {user_filter}
+            ON CONFLICT (user_id, reward_type) DO NOTHING
+        ''', {'reward_type': reward_type, 'user_id': user_id})
+
+def sync_rewards(conn=None):
+    # Полная сверка призов с текущими балансами — для ремонта данных
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+    with db.transaction(conn):
+        for points, reward_type in zip(*REWARD_THRESHOLDS['personal']):
+            cursor.execute('''
+                INSERT INTO rewards (user_id, reward_type, awarded_at)
+                SELECT user_id, %s, NOW() FROM points
+                WHERE free_points + paid_points >= %s
+                ON CONFLICT (user_id, reward_type) DO NOTHING
+            ''', (reward_type, points))
+        grant_global_rewards(rewards_reached('global', get_global_points(conn, fresh=True)), conn)
+
+@app.cli.command('sync-rewards')
+def sync_rewards_command():
+    sync_rewards()
+    print('✅ Призы сверены с балансами')
+
+# Открытые двери хранятся маской users.opened_mask: бит (day - 1) — день открыт.
+# Построчный журнал progress со временем открытия ведётся, только если он нужен
+PROGRESS_HISTORY = os.environ.get('PROGRESS_HISTORY', '1') == '1'
+# Число взведённых битов маски средствами SQL (в PostgreSQL и SQLite нет popcount для целых)
+OPENED_COUNT_SQL = ' + '.join(f'((u.opened_mask >> {bit}) & 1)' for bit in range(31))
+OPENED_BY_DAY_SQL = 'SELECT ' + ', '.join(
+    f'COALESCE(SUM((opened_mask >> {day - 1}) & 1), 0) AS d{day}' for day in range(1, 32)
+) + ' FROM users'
+
+def opened_days_of(mask):
+    return {day for day in range(1, 32) if mask >> (day - 1) & 1}
+
+def mark_days_opened(pairs, conn=None):
+    # pairs: (user_id, day); защита: только дни от 1 до 31 (новая система)
+    pairs = [(user_id, day) for user_id, day in pairs if 1 <= day <= 31]
+    if not pairs:
+        return False
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+    bits = {}
+    for user_id, day in pairs:
+        bits[user_id] = bits.get(user_id, 0) | 1 << (day - 1)
+    values, params = db.values_list(bits.items())
+    with db.transaction(conn):
+        # Биты добавляются атомарным OR; строки, где все дни уже открыты, не трогаем
+        cursor.execute(f'''
+            WITH opened (user_id, bits) AS (VALUES {values})
+            UPDATE users SET opened_mask = users.opened_mask | opened.bits
+            FROM opened
+            WHERE users.id = opened.user_id AND (users.opened_mask & opened.bits) <> opened.bits
+            RETURNING users.id
+        ''', params)
+        # Версия состояния (ETag календаря) меняется только у тех, кто открыл новый день
+        bump_stats('user_stats', 'user_id', {row['id']: {} for row in cursor.fetchall()}, conn)
+        if PROGRESS_HISTORY:
+            values, params = db.values_list(pairs, '(%s, %s, NOW())')
+            cursor.execute(f'''
+                INSERT INTO progress (user_id, day, opened_at)
+                VALUES {values}
+                ON CONFLICT (user_id, day) DO NOTHING
+            ''', params)
+    return True
+
+def mark_day_as_opened(user_id, day, conn=None):
+    return mark_days_opened([(user_id, day)], conn)
+
+# --- Сводная статистика ---
+# user_stats и day_stats обновляются вместе с исходными таблицами, чтобы админка
+# и рейтинг не пересчитывали агрегаты по всем пользователям на каждый просмотр
+STATS_REBUILD_QUERIES = [
+    'DELETE FROM user_stats',
+    'DELETE FROM day_stats',
+    '''
+        INSERT INTO user_stats (user_id, total_points, approved, rejected, version)
+        SELECT u.id,
+               COALESCE((SELECT p.free_points + p.paid_points FROM points p WHERE p.user_id = u.id), 0),
+               (SELECT COUNT(*) FROM submissions_day s WHERE s.user_id = u.id AND s.status = 'approved'),
+               (SELECT COUNT(*) FROM submissions_day s WHERE s.user_id = u.id AND s.status = 'rejected'),
+               %(version)s
+        FROM users u
+    ''',
+    '''
+        INSERT INTO day_stats (day, submitted, approved, rejected)
+        SELECT t.day,
+               (SELECT COUNT(*) FROM submissions_day s WHERE s.day = t.day),
+               (SELECT COUNT(*) FROM submissions_day s WHERE s.day = t.day AND s.status = 'approved'),
+               (SELECT COUNT(*) FROM submissions_day s WHERE s.day = t.day AND s.status = 'rejected')
+        FROM tasks t
+    ''',
+]
+
+def count_by(rows, key, column):
+    # {значение ключа: {столбец: сколько строк}} — приращения для bump_stats
+    counters = {}
+    for row in rows:
+        deltas = counters.setdefault(row[key], {column: 0})
+        deltas[column] += 1
+    return counters
+
+def bump_stats(table, key, counters, conn):
+    # Прибавляет счётчики одним upsert; ключи в пачке уникальны (их сводит count_by).
+    # У user_stats заодно растёт версия состояния пользователя (для ETag страниц)
+    if not counters:
+        return
+    if table == 'user_stats':
+        counters = {value: dict(deltas, version=1) for value, deltas in counters.items()}
+    columns = sorted({column for deltas in counters.values() for column in deltas})
+    values, params = db.values_list(
+        [(value, *[deltas.get(column, 0) for column in columns]) for value, deltas in counters.items()]
+    )
+    conn.cursor().execute(f'''
+        INSERT INTO {table} ({key}, {', '.join(columns)})
+        VALUES {values}
+        ON CONFLICT ({key}) DO UPDATE SET
+        {', '.join(f'{column} = {table}.{column} + EXCLUDED.{column}' for column in columns)}
+    ''', params)
+
+def set_user_totals(balances, conn):
+    # balances: {user_id: (free, paid)} — итоговые балансы после начисления
+    values, params = db.values_list([(user_id, free + paid, 1) for user_id, (free, paid) in balances.items()])
+    conn.cursor().execute(f'''
+        INSERT INTO user_stats (user_id, total_points, version)
+        VALUES {values}
+        ON CONFLICT (user_id) DO UPDATE SET
+            total_points = EXCLUDED.total_points,
+            version = user_stats.version + 1
+    ''', params)
+
+def rebuild_stats(conn=None):
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+    # Версии начинаем с метки времени: они не должны совпасть с версиями до пересчёта
+    params = {'version': int(time.time())}
+    with db.transaction(conn):
+        for query in STATS_REBUILD_QUERIES:
+            cursor.execute(query, params)
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    rebuild_stats()
+    print('✅ Сводная статистика пересчитана')
+
+LEADERBOARD_SIZE = 10
+LEADERBOARD_MAX = 100
+LEADERBOARD_CACHE_TTL = float(os.environ.get('LEADERBOARD_CACHE_TTL', 10))
+# (истекает в, снимок рейтинга)
+_leaderboard_cache = (0.0, None)
+
+def get_leaderboard(conn=None):
+    # Снимок рейтинга на воркер: верх таблицы и отсортированные баллы для поиска места
+    global _leaderboard_cache
+    expires_at, board = _leaderboard_cache
+    if board is not None and time.monotonic() < expires_at:
+        return board
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT s.user_id, u.username, s.total_points
+        FROM user_stats s
+        JOIN users u ON u.id = s.user_id
+        WHERE u.is_admin = 0 AND s.total_points > 0
+        ORDER BY s.total_points DESC, s.user_id
+    ''')
+    rows = cursor.fetchall()
+    # Баллы с обратным знаком — по возрастанию, как нужно bisect
+    scores = [-row['total_points'] for row in rows]
+    board = {
+        'scores': scores,
+        'points': {row['user_id']: row['total_points'] for row in rows},
+        'top': [
+            {
+                'rank': bisect.bisect_left(scores, -row['total_points']) + 1,
+                'username': row['username'],
+                'points': row['total_points'],
+            }
+            for row in rows[:LEADERBOARD_MAX]
         ],
-        'global': [
-            {'type': 'sale', 'name': 'Б/У Aegis Hero 2 за 999р', 'points': 226},
-            {'type': 'xalava', 'name': 'Скидка 50% в магазине', 'points': 777},
-            {'type': 'certificate', 'name': 'Секретный приз', 'points': 1013},
-        ]
     }
+    _leaderboard_cache = (time.monotonic() + LEADERBOARD_CACHE_TTL, board)
+    return board
 
-def mark_day_as_opened(user_id, day):
-    # Защита: только дни от 1 до 31 (новая система)
-    if day < 1 or day > 31:
-        return False  # или выбрось ошибку
-
-    conn = get_db()
-    try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO progress (user_id, day, opened_at)
-            VALUES (%s, %s, NOW())
-            ON CONFLICT (user_id, day) DO NOTHING
-        ''', (user_id, day))
-        conn.commit()
-        return True
-    finally:
-        conn.close()
+def leaderboard_rank(board, points):
+    # Место с учётом равенства баллов: 1 + число участников, набравших больше
+    return bisect.bisect_left(board['scores'], -points) + 1
 
-def can_open_door(day):
-    if day < 1 or day > 31:
-        return False
-
-    today = date.today()  # только дата, без времени
-
-    # Определяем год начала сезона
-    quest_year_start = today.year if today.month == 12 else today.year - 1
-
-    # Дата начала и конца сезона
-    season_start = date(quest_year_start, 12, 15)
-    season_end = date(quest_year_start + 1, 1, 14)
-
-    # Дата открытия двери
-    door_date = season_start + timedelta(days=day - 1)
-
-    return door_date <= today <= season_end
+def load_calendar_view(user_id, global_total, conn=None):
+    # Данные календаря пользователя — одним запросом; общий счёт уже посчитан для ETag
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT u.opened_mask, COALESCE(p.free_points, 0) AS free_points, COALESCE(p.paid_points, 0) AS paid_points
+        FROM users u LEFT JOIN points p ON p.user_id = u.id
+        WHERE u.id = %s
+    ''', (user_id,))
+    row = cursor.fetchone()
+    view = {
+        'free_points': row['free_points'] if row else 0,
+        'paid_points': row['paid_points'] if row else 0,
+        'opened_mask': row['opened_mask'] if row else 0,
+        'global_total': global_total,
+    }
+    view['personal_total'] = view['free_points'] + view['paid_points']
+    return view
+
+# --- Фрагменты календаря ---
+# Сетка дверей и таблицы призов зависят только от дня сезона, открытых дней и
+# числа достигнутых целей — у многих пользователей эти куски HTML одинаковы
+def render_calendar_grid(schedule, opened_mask):
+    return fragments.cached(
+        f'grid:{BUILD_ID}:{schedule.start}:{schedule.today}:{opened_mask:x}',
+        lambda: render_template('calendar_grid.html', schedule=schedule, opened_days=opened_days_of(opened_mask))
+    )
 
-def get_calendar_days():
-    days = []
-    today = date.today()
-    quest_year = today.year if today.month == 12 else today.year - 1
-    start = date(quest_year, 12, 15)
+def render_rewards_panel(personal_total, global_total):
+    reached = (len(rewards_reached('personal', personal_total)), len(rewards_reached('global', global_total)))
+    return fragments.cached(
+        f'rewards:{BUILD_ID}:{reached[0]}:{reached[1]}',
+        lambda: render_template(
+            'calendar_rewards.html',
+            reward_targets=get_reward_targets(),
+            personal_total=personal_total,
+            global_total=global_total
+        )
+    )
 
-    for i in range(31):
-        current = start + timedelta(days=i)
-        if current.month == 12:
-            date_str = f'{current.day} декабря'
-        else:
-            date_str = f'{current.day} января'
-        days.append({'day': i + 1, 'date': date_str})
-    return days
+# --- Кеш заданий ---
+# Заданий всего 31 и меняются они редко: каждый воркер держит их в памяти
+# и раз в TASK_CACHE_TTL секунд сверяет версию таблицы: её увеличивает триггер на tasks.
+TASK_CACHE_TTL = float(os.environ.get('TASK_CACHE_TTL', 5))
+_task_cache = {'tasks': {}, 'version': None, 'checked_at': 0.0}
+_task_cache_lock = threading.Lock()
+
+def _get_tasks(conn=None):
+    if time.monotonic() - _task_cache['checked_at'] < TASK_CACHE_TTL:
+        return _task_cache['tasks']
+    with _task_cache_lock:
+        if time.monotonic() - _task_cache['checked_at'] < TASK_CACHE_TTL:
+            return _task_cache['tasks']
+        if conn is None:
+            conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute('SELECT version FROM tasks_version WHERE id = 1')
+        version = cursor.fetchone()['version']
+        if version != _task_cache['version']:
+            cursor.execute('SELECT * FROM tasks ORDER BY day')
+            _task_cache['tasks'] = {task['day']: dict(task) for task in cursor.fetchall()}
+            _task_cache['version'] = version
+        _task_cache['checked_at'] = time.monotonic()
+        return _task_cache['tasks']
+
+def get_task(day, conn=None, published_only=True):
+    task = _get_tasks(conn).get(day)
+    if task and published_only and not task['is_published']:
+        return None
+    return task
+
+def list_published_tasks(conn=None):
+    return [task for task in _get_tasks(conn).values() if task['is_published']]
+
+def invalidate_tasks(conn=None):
+    # Принудительная перезагрузка: увеличиваем версию в базе, чтобы задания перечитали все воркеры,
+    # а кеш этого воркера сбрасываем сразу
+    if conn is None:
+        conn = get_db()
+    conn.cursor().execute('UPDATE tasks_version SET version = version + 1 WHERE id = 1')
+    with _task_cache_lock:
+        _task_cache['version'] = None
+        _task_cache['checked_at'] = 0.0
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+@app.template_filter('datetime')
+def format_datetime(value, fmt='%Y-%m-%d %H:%M'):
+    return value.strftime(fmt) if value else '-'
+
 @app.context_processor
 def inject_functions():
     return {
-        'can_open': can_open_door,  # теперь можно использовать в шаблоне
-        'now': datetime.now()  # чтобы использовать {{ now.year }}
+        'now': datetime.now(),  # чтобы использовать {{ now.year }}
+        'thumbnail_url': thumbnail_url,
+        'is_image': thumbnails.is_image,
+        'static_url': static_url
     }
 
-def check_rewards(user_id, conn=None):
-    close_after = False
+# --- HTTP-кеширование ---
+def static_url(filename):
+    # Адрес статики с хешем содержимого: такой ответ кешируется навсегда
+    return url_for('static', filename=filename, v=assets.file_hash(os.path.join(app.static_folder, filename)))
+
+def serve_static(filename):
+    # Готовые .br/.gz копии (flask compress-static) отдаются вместо сжатия на лету
+    variant, encoding = assets.precompressed(app.static_folder, filename, request.accept_encodings)
+    if variant:
+        response = send_from_directory(
+            app.static_folder, variant, mimetype=mimetypes.guess_type(filename)[0]
+        )
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = app.send_static_file(filename)
+    response.vary.add('Accept-Encoding')
+    # Загрузки лежат по хешу содержимого и не хешируются заново; остальное — если хеш
+    # в адресе совпал с текущим
+    if filename.startswith('uploads/'):
+        versioned = True
+    else:
+        version = request.args.get('v')
+        versioned = version is not None and version == assets.file_hash(os.path.join(app.static_folder, filename))
+    if versioned:
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = assets.IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+app.view_functions['static'] = serve_static
+
+@app.cli.command('compress-static')
+def compress_static_command():
+    written = assets.compress_folder(app.static_folder)
+    print(f'✅ Сжатых копий статики записано: {written}')
+
+def _build_id():
+    # Меняется с кодом и шаблонами — после деплоя старые ETag не совпадут
+    digest = hashlib.sha1()
+    template_dir = os.path.join(app.root_path, 'templates')
+    for path in [__file__] + sorted(os.path.join(template_dir, name) for name in os.listdir(template_dir)):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+BUILD_ID = _build_id()
+
+def user_state_version(user_id, conn=None):
     if conn is None:
         conn = get_db()
-        close_after = True
-    try:
-        cursor = conn.cursor()
-
-        cursor.execute('SELECT free_points, paid_points FROM points WHERE user_id = %s', (user_id,))
-        row = cursor.fetchone()
-        personal_total = (row['free_points'] + row['paid_points']) if row else 0
-
-        cursor.execute('SELECT reward_type FROM rewards WHERE user_id = %s', (user_id,))
-        awarded = {r['reward_type'] for r in cursor.fetchall()}
-
-        # Призы за личные баллы
-        targets_personal = {
-            'xalava': 555,
-            'small': 1276,
-            'merch': 1444,
-            'medium': 1651,
-            'dostavka': 1888,
-            'large': 2026
-        }
-        for r_type, points in targets_personal.items():
-            if personal_total >= points and r_type not in awarded:
-                cursor.execute('INSERT INTO rewards (user_id, reward_type, awarded_at) VALUES (%s, %s, NOW())', (user_id, r_type))
-
-        # Общий счёт
-        current_global = get_global_points()
-
-        targets_global = {
-            'sale': 226,
-            'xalava': 777,
-            'certificate': 1013
-        }
-        for r_type, points in targets_global.items():
-            if current_global >= points and r_type not in awarded:
-                cursor.execute('INSERT INTO rewards (user_id, reward_type, awarded_at) VALUES (%s, %s, NOW())', (user_id, r_type))
-
-        conn.commit()
-    finally:
-        if close_after:
-            conn.close()
+    cursor = conn.cursor()
+    cursor.execute('SELECT version FROM user_stats WHERE user_id = %s', (user_id,))
+    row = cursor.fetchone()
+    return row['version'] if row else 0
+
+def page_etag(*parts):
+    # ETag персональной страницы из версий всего, что на неё влияет.
+    # None — отвечать 304 нельзя: в сессии ждут flash-сообщения
+    if session.get('_flashes'):
+        return None
+    key = '|'.join(str(part) for part in (
+        BUILD_ID, session.get('user_id'), session.get('username'), session.get('is_admin'),
+        season.get_schedule().today, _task_cache['version'], *parts
+    ))
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+def cache_page(response, etag):
+    # Страница кешируется только браузером и перепроверяется при каждом показе
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+def not_modified(etag):
+    if etag and request.if_none_match.contains_weak(etag):
+        return cache_page(app.response_class(status=304), etag)
+    return None
+
+def thumbnail_url(file_url, size='thumb'):
+    # Ссылка на готовое превью; None — ещё не построено или файл не картинка
+    if not file_url or not thumbnails.is_image(file_url):
+        return None
+    key = thumbnails.thumbnail_key(file_url, size)
+    if not storage.get_storage().exists(key):
+        return None
+    return url_for('static', filename='uploads/' + key)
+
+@app.cli.command('thumbnails')
+def thumbnails_command():
+    # Достраивает превью для уже загруженных картинок
+    cursor = get_db().cursor()
+    cursor.execute('SELECT DISTINCT file_url FROM submissions_day WHERE file_url IS NOT NULL')
+    futures = [thumbnails.enqueue(storage.get_storage(), row['file_url']) for row in cursor.fetchall()]
+    futures = [future for future in futures if future is not None]
+    for future in futures:
+        future.exception()
+    print(f'✅ Построено превью: {len(futures)}')
 
 # --- Маршруты ---
 @app.before_request
@@ -376,52 +734,31 @@ def calendar():
     if not user_id:
         return redirect(url_for('login'))
 
-    free, paid = get_user_points(user_id)
-    personal_total = free + paid
-    global_total = get_global_points()
-
     conn = get_db()
-    try:
-        cursor = conn.cursor()
-        cursor.execute('SELECT day FROM progress WHERE user_id = %s', (user_id,))
-        opened_days = {row['day'] for row in cursor.fetchall()}
-
-        cursor.execute('SELECT reward_type FROM rewards WHERE user_id = %s', (user_id,))
-        awarded_rewards = {row['reward_type'] for row in cursor.fetchall()}
-    finally:
-        conn.close()
-
-    # Доступные дни
-    now = datetime.now().date()
-
-    year_start = now.year if now.month == 12 else now.year - 1  # если январь — значит, начало было в прошлом году
-    season_start = datetime(year_start, 12, 15).date()
-    season_end = datetime(year_start + 1, 1, 14).date()  # 14 января следующего года
-
-    available_days = set()
+    _get_tasks(conn)
+    global_total = get_global_points(conn)
+    etag = page_etag('calendar', user_state_version(user_id, conn), global_total, events.enabled())
+    response = not_modified(etag)
+    if response:
+        return response
 
-    for day in range(1, 32):
-        door_date = season_start + timedelta(days=day - 1)
-        if door_date <= now <= season_end:
-            available_days.add(day)
+    view = load_calendar_view(user_id, global_total, conn)
+    schedule = season.get_schedule()
 
-    reward_targets = get_reward_targets()
-
-    return render_template(
+    return cache_page(make_response(render_template(
         'calendar.html',
         user=session.get('username'),
         is_admin=session.get('is_admin', False),
-        opened_days=opened_days,
-        calendar_days=get_calendar_days(),
-        can_open=can_open_door,
-        free_points=free,
-        paid_points=paid,
-        personal_total=personal_total,
-        global_total=global_total,
-        available_days=available_days,
-        reward_targets=reward_targets,
-        awarded_rewards=awarded_rewards
-    )
+        schedule=schedule,
+        live_updates=events.available(),
+        poll_interval=CALENDAR_POLL_INTERVAL,
+        calendar_grid=render_calendar_grid(schedule, view['opened_mask']),
+        rewards_panel=render_rewards_panel(view['personal_total'], view['global_total']),
+        free_points=view['free_points'],
+        paid_points=view['paid_points'],
+        personal_total=view['personal_total'],
+        global_total=view['global_total']
+    )), etag)
 
 @app.route('/day/<int:day>', methods=['GET', 'POST'])
 def view_day(day):
@@ -431,40 +768,47 @@ def view_day(day):
     user_id = session.get('user_id')
     if not user_id:
         return redirect(url_for('login'))
+    if request.method == 'POST':
+        # Тело формы дочитывается до взятия соединения из пула: медленная загрузка его не занимает
+        try:
+            request.files
+        except RequestEntityTooLarge:
+            flash(f'Файл слишком большой (максимум {UPLOAD_MAX_MB} МБ).')
+            return redirect(url_for('view_day', day=day))
 
     conn = get_db()
-    try:
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM tasks WHERE day = %s AND is_published = 1', (day,))
-        task = cursor.fetchone()
-        if not task:
-            flash('Задание не опубликовано.')
-            return redirect(url_for('calendar'))
-        if not can_open_door(day):
-            flash('День ещё не наступил.')
-            return redirect(url_for('calendar'))
+    cursor = conn.cursor()
+    task = get_task(day, conn)
+    if not task:
+        flash('Задание не опубликовано.')
+        return redirect(url_for('calendar'))
+    if not season.get_schedule().can_open(day):
+        flash('День ещё не наступил.')
+        return redirect(url_for('calendar'))
 
-        cursor.execute('SELECT status FROM submissions_day WHERE user_id = %s AND day = %s', (user_id, day))
-        submission = cursor.fetchone()
-    finally:
-        conn.close()
+    etag = None
+    if request.method == 'GET':
+        # Ответ пользователя меняет версию его состояния, задание — версию кеша заданий
+        etag = page_etag('day', day, user_state_version(user_id, conn))
+        response = not_modified(etag)
+        if response:
+            return response
 
     if request.method == 'POST':
-        if submission:
-            flash('Вы уже отправили ответ.')
-            return redirect(url_for('view_day', day=day))
-
-        conn = get_db()
+        # Токен формы отличает повтор той же отправки от второй попытки ответить
+        token = request.form.get('token') or None
         try:
+            store = storage.get_storage()
+            file = None
             file_url = None
             text_response = None
 
             if task['response_type'] == 'file':
-                file = request.files['file']
+                file = request.files.get('file')
                 if file and allowed_file(file.filename):
-                    filename = secure_filename(f"day{day}_user{user_id}_{file.filename}")
-                    file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                    file_url = filename
+                    # Ключ по содержимому известен до сохранения: одинаковые файлы хранятся один раз
+                    extension = file.filename.rsplit('.', 1)[1].lower()
+                    file_url = store.key_for(file.stream.hexdigest(), extension)
                 else:
                     flash('Некорректный файл.')
                     return redirect(url_for('view_day', day=day))
@@ -475,98 +819,428 @@ def view_day(day):
                     return redirect(url_for('view_day', day=day))
                 
             cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO submissions_day (user_id, day, file_url, text_response, submitted_at, status)
-                VALUES (%s, %s, %s, %s, NOW(), 'pending')
-            ''', (user_id, day, file_url, text_response))
-            conn.commit()
-            flash('Ответ отправлен на проверку.')
+            with db.transaction(conn):
+                # Гонку двух отправок решает уникальный ключ (user_id, day), а не проверка перед вставкой
+                cursor.execute('''
+                    INSERT INTO submissions_day (user_id, day, file_url, text_response, submitted_at, status, submission_token)
+                    VALUES (%s, %s, %s, %s, NOW(), 'pending', %s)
+                    ON CONFLICT (user_id, day) DO NOTHING
+                    RETURNING id
+                ''', (user_id, day, file_url, text_response, token))
+                inserted = cursor.fetchone() is not None
+                if inserted:
+                    # Файл переносится в хранилище только для вставленной строки; при ошибке строка откатится
+                    if file is not None:
+                        store.store(file.stream, extension)
+                    bump_stats('day_stats', 'day', {day: {'submitted': 1}}, conn)
+                    bump_stats('user_stats', 'user_id', {user_id: {}}, conn)
+
+            if inserted:
+                # Превью для модераторов строятся в фоне
+                thumbnails.enqueue(store, file_url)
+                flash('Ответ отправлен на проверку.')
+            else:
+                # Временный файл проигравшей отправки удаляется при закрытии загрузки в конце запроса
+                cursor.execute('SELECT submission_token FROM submissions_day WHERE user_id = %s AND day = %s', (user_id, day))
+                existing = cursor.fetchone()
+                if token and existing and existing['submission_token'] == token:
+                    flash('Ответ отправлен на проверку.')
+                else:
+                    flash('Вы уже отправили ответ.')
         except Exception as e:
             flash('Ошибка при отправке.')
             print(e)
-        finally:
-            conn.close()
 
         return redirect(url_for('view_day', day=day))
 
-    return render_template('day.html', task=task, day=day, submission=submission)
+    cursor.execute('SELECT status FROM submissions_day WHERE user_id = %s AND day = %s', (user_id, day))
+    submission = cursor.fetchone()
+    return cache_page(make_response(render_template(
+        'day.html', task=task, day=day, submission=submission, token=secrets.token_hex(16)
+    )), etag)
+
+@app.route('/leaderboard')
+def leaderboard():
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect(url_for('login'))
+    limit = min(max(1, request.args.get('limit', LEADERBOARD_SIZE, type=int)), LEADERBOARD_MAX)
+    board = get_leaderboard()
+    points = board['points'].get(user_id, 0)
+    return jsonify(
+        top=board['top'][:limit],
+        me={'rank': leaderboard_rank(board, points), 'points': points},
+        participants=len(board['scores'])
+    )
+
+@app.route('/events')
+def events_stream():
+    # Живые обновления календаря: общий счёт и проверка ответов пользователя
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'unauthorized'}), 401
+    body = events.stream(['global', f'user:{user_id}'])
+    if body is None:
+        return jsonify({'error': 'too many streams'}), 503
+    return Response(body, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+@app.route('/calendar/totals')
+def calendar_totals():
+    # Замена /events, когда поток выключен или занят: страница опрашивает счёт раз в
+    # CALENDAR_POLL_INTERVAL секунд, а без изменений получает 304
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'unauthorized'}), 401
+    conn = get_db()
+    global_total = get_global_points(conn)
+    etag = page_etag('totals', user_state_version(user_id, conn), global_total)
+    response = not_modified(etag)
+    if response:
+        return response
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT u.opened_mask, COALESCE(s.total_points, 0) AS total_points
+        FROM users u LEFT JOIN user_stats s ON s.user_id = u.id
+        WHERE u.id = %s
+    ''', (user_id,))
+    row = cursor.fetchone()
+    return cache_page(jsonify({
+        'global_total': global_total,
+        'personal_total': row['total_points'] if row else 0,
+        'opened': sorted(opened_days_of(row['opened_mask'])) if row else [],
+    }), etag)
+
+SUBMISSIONS_PAGE_SIZE = 50
+SUBMISSION_STATUSES = ('pending', 'approved', 'rejected')
+
+def parse_submissions_filters(args):
+    # Фильтры очереди: по умолчанию показываем только ожидающие проверки
+    status = args.get('status', 'pending')
+    if status not in SUBMISSION_STATUSES:
+        status = 'all'
+    response_type = args.get('type')
+    if response_type not in ('file', 'text'):
+        response_type = None
+    day = args.get('day', type=int)
+    if day is not None and not 1 <= day <= 31:
+        day = None
+    return {'status': status, 'day': day, 'type': response_type, 'user': args.get('user', type=int)}
+
+def build_submissions_where(filters):
+    conditions = []
+    params = []
+    if filters['status'] != 'all':
+        conditions.append('s.status = %s')
+        params.append(filters['status'])
+    if filters['day'] is not None:
+        conditions.append('s.day = %s')
+        params.append(filters['day'])
+    if filters['user'] is not None:
+        conditions.append('s.user_id = %s')
+        params.append(filters['user'])
+    if filters['type']:
+        # Фильтр по типу ответа сводится к списку дней из кеша заданий и идёт по индексу на day
+        days = [day for day, task in _get_tasks().items() if task['response_type'] == filters['type']]
+        if days:
+            conditions.append(f"s.day IN ({', '.join(['%s'] * len(days))})")
+            params.extend(days)
+        else:
+            conditions.append('1 = 0')
+    return conditions, params
+
+def parse_submissions_cursor(value):
+    # Курсор — пара (submitted_at, id) последней строки предыдущей страницы
+    try:
+        submitted_at, sub_id = value.rsplit('_', 1)
+        return datetime.fromisoformat(submitted_at), int(sub_id)
+    except (AttributeError, ValueError):
+        return None
 
 @app.route('/admin/submissions')
 def admin_submissions():
     if not session.get('is_admin'): 
         return redirect(url_for('login'))
-    
-    submissions = []
+
+    filters = parse_submissions_filters(request.args)
+    conditions, params = build_submissions_where(filters)
+    cursor_value = parse_submissions_cursor(request.args.get('before'))
+    if cursor_value:
+        conditions.append('(s.submitted_at, s.id) < (%s, %s)')
+        params.extend(cursor_value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
     conn = get_db()
-    try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT s.id, s.user_id, s.day, s.file_url, s.text_response, s.submitted_at, s.status,
-                   u.username, t.title, t.points_free, t.points_global, t.is_paid, t.response_type
-            FROM submissions_day s
-            JOIN users u ON s.user_id = u.id
-            JOIN tasks t ON s.day = t.day
-            ORDER BY s.submitted_at DESC
-        ''')
-        raw_submissions = cursor.fetchall()
-        
-        submissions = []
-        for row in raw_submissions:
-            sub = dict(row)
-            sub['submitted_at_str'] = (
-                row['submitted_at'].strftime('%Y-%m-%d %H:%M') 
-                if row['submitted_at'] else '-'
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT s.id, s.user_id, s.day, s.file_url, s.text_response, s.submitted_at, s.status,
+               u.username
+        FROM submissions_day s
+        JOIN users u ON s.user_id = u.id
+        {where}
+        ORDER BY s.submitted_at DESC, s.id DESC
+        LIMIT %s
+    ''', (*params, SUBMISSIONS_PAGE_SIZE + 1))
+    submissions = cursor.fetchall()
+
+    next_cursor = None
+    if len(submissions) > SUBMISSIONS_PAGE_SIZE:
+        submissions = submissions[:SUBMISSIONS_PAGE_SIZE]
+        last = submissions[-1]
+        next_cursor = f"{last['submitted_at'].isoformat()}_{last['id']}"
+
+    return render_template(
+        'admin_submissions.html',
+        submissions=submissions,
+        tasks=_get_tasks(conn),
+        filters=filters,
+        next_cursor=next_cursor
+    )
+
+BULK_REVIEW_LIMIT = 500
+REVIEW_ACTIONS = {'approve': 'approved', 'reject': 'rejected'}
+
+def review_submissions(sub_ids, action, conn=None):
+    # Одобрение/отклонение пачки ответов одной транзакцией, без запросов на каждый ответ
+    status = REVIEW_ACTIONS[action]
+    sub_ids = list(dict.fromkeys(sub_ids))
+    results = {sub_id: {'status': 'skipped', 'reason': 'not_pending'} for sub_id in sub_ids}
+    if not sub_ids:
+        return results
+    if conn is None:
+        conn = get_db()
+    cursor = conn.cursor()
+
+    with db.transaction(conn):
+        cursor.execute(f'''
+            UPDATE submissions_day SET status = %s
+            WHERE status = 'pending' AND id IN ({', '.join(['%s'] * len(sub_ids))})
+            RETURNING id, user_id, day
+        ''', (status, *sub_ids))
+        reviewed = cursor.fetchall()
+        bump_stats('user_stats', 'user_id', count_by(reviewed, 'user_id', status), conn)
+        bump_stats('day_stats', 'day', count_by(reviewed, 'day', status), conn)
+
+        credits = []
+        global_points = 0
+        for sub in reviewed:
+            result = {'status': status, 'user_id': sub['user_id'], 'day': sub['day']}
+            results[sub['id']] = result
+            if status != 'approved':
+                continue
+            task = get_task(sub['day'], conn, published_only=False) or {}
+            points = task.get('points_free', 0)
+            free, paid = (0, points) if task.get('is_paid') else (points, 0)
+            credits.append((sub['user_id'], free, paid, sub['id'], 'submission'))
+            global_points += task.get('points_global', 0)
+            result.update(
+                is_paid=bool(task.get('is_paid')),
+                free_points=free,
+                paid_points=paid,
+                global_points=task.get('points_global', 0)
             )
-            submissions.append(sub)
-            
-    finally:
-        conn.close()
-    
-    return render_template('admin_submissions.html', submissions=submissions)
+
+        balances = {}
+        global_total = None
+        if credits:
+            balances = credit_points(credits, conn)
+            # Общий счёт — одно начисление на всю пачку; командные пороги сверяются после COMMIT
+            if global_points:
+                global_total = add_to_global_points(global_points, conn)
+            mark_days_opened([(sub['user_id'], sub['day']) for sub in reviewed], conn)
+
+    if global_total is not None:
+        settle_global_milestones(conn)
+    # События — только после фиксации транзакции
+    for sub in reviewed:
+        event = dict(results[sub['id']], submission_id=sub['id'])
+        if sub['user_id'] in balances:
+            event['personal_total'] = sum(balances[sub['user_id']])
+        events.publish(f'user:{sub["user_id"]}', 'review', event)
+    if global_total is not None:
+        events.publish('global', 'global', {'total': global_total})
+    return results
+
+# --- Выгрузки ---
+# Ответы читаются серверным курсором и отдаются генератором: память не зависит от числа строк
+EXPORT_COLUMNS = (
+    'id', 'user_id', 'username', 'day', 'task_title', 'response_type',
+    'status', 'submitted_at', 'text_response', 'file_url',
+)
+EXPORT_CHUNK = 256 * 1024
+
+def export_rows(filters, files_only=False):
+    conditions, params = build_submissions_where(filters)
+    if files_only:
+        conditions.append('s.file_url IS NOT NULL')
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    tasks = _get_tasks()
+    for row in db.iter_rows(get_db(), f'''
+        SELECT s.id, s.user_id, u.username, s.day, s.status, s.submitted_at, s.text_response, s.file_url
+        FROM submissions_day s
+        JOIN users u ON s.user_id = u.id
+        {where}
+        ORDER BY s.day, s.id
+    ''', params):
+        task = tasks.get(row['day'], {})
+        yield {
+            'id': row['id'],
+            'user_id': row['user_id'],
+            'username': row['username'],
+            'day': row['day'],
+            'task_title': task.get('title'),
+            'response_type': task.get('response_type'),
+            'status': row['status'],
+            'submitted_at': row['submitted_at'].isoformat() if row['submitted_at'] else None,
+            'text_response': row['text_response'],
+            'file_url': row['file_url'],
+        }
+
+# Ячейка, начинающаяся с этих символов, в Excel становится формулой — ответы пишут пользователи
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def csv_cell(value):
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def export_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM — чтобы Excel открыл кириллицу без мастера импорта
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([csv_cell(row[column]) for column in EXPORT_COLUMNS])
+        if buffer.tell() >= EXPORT_CHUNK:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def export_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+class ZipSink:
+    # Принимает вывод ZipFile; накопленное забирает генератор ответа
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def export_zip(rows):
+    # Архив без сжатия (картинки уже сжаты) пишется в поток с дескрипторами данных
+    sink = ZipSink()
+    store = storage.get_storage()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED) as archive:
+        for row in rows:
+            key = row['file_url']
+            if not store.exists(key):
+                continue
+            # Имя участника в пути архива: только буквы, цифры, точка и дефис
+            username = re.sub(r'[^\w.-]', '_', row['username']).strip('.') or f"user_{row['user_id']}"
+            name = f"day_{row['day']:02d}/{username}_{row['id']}.{key.rsplit('.', 1)[-1]}"
+            with store.open(key) as source, archive.open(name, 'w', force_zip64=True) as target:
+                while True:
+                    chunk = source.read(EXPORT_CHUNK)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', export_csv),
+    'jsonl': ('application/x-ndjson', export_jsonl),
+    'zip': ('application/zip', export_zip),
+}
+
+@app.route('/admin/submissions/export.<fmt>')
+def export_submissions(fmt):
+    if not session.get('is_admin'):
+        return redirect(url_for('login'))
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'format must be csv, jsonl or zip'}), 404
+    filters = parse_submissions_filters(request.args)
+    if fmt == 'zip' and filters['day'] is None and filters['user'] is None:
+        return jsonify({'error': 'zip export needs a day or user filter'}), 400
+
+    mimetype, render = EXPORT_FORMATS[fmt]
+    suffix = ''.join(f'_{name}{filters[name]}' for name in ('day', 'user') if filters[name] is not None)
+    body = render(export_rows(filters, files_only=fmt == 'zip'))
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=submissions{suffix}.{fmt}',
+    })
+
+@app.route('/admin/submissions/review', methods=['POST'])
+def review_submissions_bulk():
+    if not session.get('is_admin'):
+        return jsonify({'error': 'forbidden'}), 403
+    if request.is_json:
+        # Строка вместо списка разобралась бы по символам: "12" — это ответы 1 и 2
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get('ids'), list):
+            return jsonify({'error': 'body must be an object with an ids list'}), 400
+        ids = payload['ids']
+    else:
+        payload = request.form
+        ids = request.form.getlist('ids')
+    action = payload.get('action')
+    try:
+        ids = [int(sub_id) for sub_id in ids]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'ids must be integers'}), 400
+    if action not in REVIEW_ACTIONS:
+        return jsonify({'error': 'action must be approve or reject'}), 400
+    if len(ids) > BULK_REVIEW_LIMIT:
+        return jsonify({'error': f'at most {BULK_REVIEW_LIMIT} ids per request'}), 400
+
+    results = review_submissions(ids, action)
+    return jsonify({
+        'results': {str(sub_id): result for sub_id, result in results.items()},
+        'processed': sum(1 for result in results.values() if result['status'] != 'skipped'),
+    })
 
 @app.route('/admin/approve/day/<int:sub_id>')
 def approve_day_submission(sub_id):
     if not session.get('is_admin'): 
         return redirect(url_for('login'))
-    
-    conn = get_db()
-    try:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT s.id, s.user_id, s.day, t.points_free, t.points_global, t.is_paid
-            FROM submissions_day s
-            JOIN tasks t ON s.day = t.day
-            WHERE s.id = %s AND s.status = 'pending'
-        ''', (sub_id,))
-        sub = cursor.fetchone()
-        if not sub:
-            flash('Задание уже обработано.')
-            return redirect(url_for('admin_submissions'))
-
-        cursor.execute('UPDATE submissions_day SET status = %s WHERE id = %s', ('approved', sub_id))
-        conn.commit()
-
-        if sub['is_paid']:
-            add_points(sub['user_id'], 0, sub['points_free'])
-            flash(f'✅ +{sub["points_free"]} платных, +{sub["points_global"]} общих.')
-        else:
-            add_points(sub['user_id'], sub['points_free'], 0)
-            flash(f'✅ +{sub["points_free"]} личных, +{sub["points_global"]} общих.')
-
-        # Обновляем общий счёт
-        add_to_global_points(sub['points_global'])
-        
-        # Проверяем призы — теперь и глобальные тоже раздаются!
-        check_rewards(sub['user_id'], conn)
-
-        mark_day_as_opened(sub['user_id'], sub['day'])
-        return redirect(url_for('admin_submissions'))
 
+    try:
+        result = review_submissions([sub_id], 'approve')[sub_id]
     except Exception as e:
         flash(f'❌ Ошибка: {str(e)}')
         return redirect(url_for('admin_submissions'))
-    finally:
-        conn.close()
+
+    if result['status'] == 'skipped':
+        flash('Задание уже обработано.')
+    elif result['is_paid']:
+        flash(f'✅ +{result["paid_points"]} платных, +{result["global_points"]} общих.')
+    else:
+        flash(f'✅ +{result["free_points"]} личных, +{result["global_points"]} общих.')
+    return redirect(url_for('admin_submissions'))
+
+ADMIN_PAGE_SIZE = 50
+# Разрешённые поля сортировки списка пользователей в админке
+ADMIN_SORT_COLUMNS = {
+    'username': 'u.username',
+    'points': 'total_points',
+    'opened': 'total_opened',
+}
 
 @app.route('/admin')
 def admin():
@@ -574,63 +1248,76 @@ def admin():
         flash('Доступ запрещён.')
         return redirect(url_for('login'))
 
-    users = []
-    stats = {}
-    user_points = {}
+    sort = request.args.get('sort', 'username')
+    if sort not in ADMIN_SORT_COLUMNS:
+        sort = 'username'
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    page = max(1, request.args.get('page', 1, type=int))
 
     conn = get_db()
-    try:
-        cursor = conn.cursor()
-
-        # Получаем всех пользователей
-        cursor.execute('SELECT id, username FROM users ORDER BY username')
-        users = cursor.fetchall()
-
-        # Статистика: сколько дней открыл каждый
-        cursor.execute('''
-            SELECT u.username, COUNT(p.day) as total_opened
-            FROM users u
-            LEFT JOIN progress p ON u.id = p.user_id
-            GROUP BY u.id, u.username
-        ''')
-        for row in cursor.fetchall():
-            stats[row['username']] = {'total_opened': row['total_opened']}
-
-        # Личные баллы
-        for user in users:
-            free, paid = get_user_points(user['id'])
-            user_points[user['username']] = free + paid
-
-    finally:
-        conn.close()
+    cursor = conn.cursor()
+
+    # Баллы — из сводной таблицы, число открытых дней — по маске, без агрегатов
+    cursor.execute(f'''
+        SELECT u.id, u.username,
+               COALESCE(s.total_points, 0) AS total_points,
+               {OPENED_COUNT_SQL} AS total_opened,
+               COUNT(*) OVER () AS total_users
+        FROM users u
+        LEFT JOIN user_stats s ON s.user_id = u.id
+        ORDER BY {ADMIN_SORT_COLUMNS[sort]} {order}, u.id
+        LIMIT %s OFFSET %s
+    ''', (ADMIN_PAGE_SIZE, (page - 1) * ADMIN_PAGE_SIZE))
+    users = cursor.fetchall()
+    total_users = users[0]['total_users'] if users else 0
+
+    cursor.execute('SELECT day, submitted, approved, rejected FROM day_stats ORDER BY day')
+    day_stats = [dict(row) for row in cursor.fetchall()]
+    # Сколько пользователей открыли каждый день — один проход по маскам
+    cursor.execute(OPENED_BY_DAY_SQL)
+    opened_by_day = cursor.fetchone()
+    for row in day_stats:
+        row['opened'] = opened_by_day[f"d{row['day']}"]
 
     # Получаем актуальные цели призов
     reward_targets = get_reward_targets()
-    global_points = get_global_points()
+    global_points = get_global_points(conn)
 
     return render_template(
         'admin.html',
+        published_tasks=len(list_published_tasks(conn)),
         users=users,
-        stats=stats,
-        user_points=user_points,
         global_points=global_points,
-        reward_targets=reward_targets
+        reward_targets=reward_targets,
+        sort=sort,
+        order=order,
+        page=page,
+        pages=max(1, -(-total_users // ADMIN_PAGE_SIZE)),
+        total_users=total_users,
+        day_stats=day_stats
     )
 
 @app.route('/admin/add_global', methods=['POST'])
 def add_global():
     if not session.get('is_admin'): return redirect(url_for('login'))
     points = int(request.form['points'])
-    add_to_global_points(points)
+    events.publish('global', 'global', {'total': add_to_global_points(points)})
     flash(f'+{points} к общему счёту')
     return redirect(url_for('admin'))
 
+@app.route('/admin/reload_tasks', methods=['POST'])
+def reload_tasks():
+    if not session.get('is_admin'): return redirect(url_for('login'))
+    invalidate_tasks()
+    flash(f'Задания перечитаны: опубликовано {len(list_published_tasks())}')
+    return redirect(url_for('admin'))
+
 @app.route('/admin/add_user_points', methods=['POST'])
 def add_user_points():
     if not session.get('is_admin'): return redirect(url_for('login'))
     user_id = int(request.form['user_id'])
     points = int(request.form['points'])
-    add_points(user_id, points, 0)
+    add_points(user_id, points, 0, reason='admin')
     flash(f'+{points} пользователю')
     return redirect(url_for('admin'))
 
@@ -638,18 +1325,12 @@ def add_user_points():
 def remove_global():
     if not session.get('is_admin'): return redirect(url_for('login'))
     points = int(request.form['points'])
-    current = get_global_points()
-    if points > current:
+    removed, current = remove_from_global_points(points)
+    if not removed:
         flash(f'❌ Нельзя снять {points} (всего: {current})')
     else:
-        conn = get_db()
-        try:
-            cursor = conn.cursor()
-            cursor.execute('UPDATE global_progress SET total_points = %s WHERE id = 1', (max(0, current - points),))
-            conn.commit()
-            flash(f'✅ Снято {points} из общего счёта')
-        finally:
-            conn.close()
+        events.publish('global', 'global', {'total': current})
+        flash(f'✅ Снято {points} из общего счёта')
     return redirect(url_for('admin'))
 
 @app.route('/admin/remove_user_points', methods=['POST'])
@@ -662,29 +1343,55 @@ def remove_user_points():
     if points > total: flash(f'❌ Нельзя снять {points} (у пользователя: {total})')
     else: 
         # Просто уменьшаем общие (можно уточнить, откуда снимать)
-        add_points(user_id, -points, 0)
+        add_points(user_id, -points, 0, reason='admin')
         flash(f'✅ Снято {points}')
     return redirect(url_for('admin'))
 
+@app.route('/admin/db_pool')
+def db_pool_stats():
+    if not session.get('is_admin'): return redirect(url_for('login'))
+    return jsonify(db.get_pool().stats())
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    # Заполняется только при REQUEST_METRICS=1
+    if not session.get('is_admin'): return redirect(url_for('login'))
+    return jsonify(
+        enabled=metrics.ENABLED, db_pool=db.get_pool().stats(), fragments=fragments.local.stats(), **metrics.snapshot()
+    )
+
+def client_ip():
+    # За прокси Render адрес клиента приходит в X-Forwarded-For (см. TRUSTED_PROXIES)
+    return request.remote_addr or 'unknown'
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        hashed = generate_password_hash(password)
+        if not passwords.login_ip_limiter.hit(client_ip()):
+            flash('Слишком много попыток. Подождите минуту.')
+            return render_template('register.html'), 429
+        try:
+            hashed = passwords.hash_password(password)
+        except passwords.Busy:
+            flash('Сервер перегружен, попробуйте через несколько секунд.')
+            return render_template('register.html'), 503
         conn = get_db()
         try:
             cursor = conn.cursor()
-            cursor.execute('INSERT INTO users (username, password) VALUES (%s, %s)', (username, hashed))
-            conn.commit()
+            with db.transaction(conn):
+                cursor.execute(
+                    'INSERT INTO users (username, password) VALUES (%s, %s) RETURNING id',
+                    (username, hashed)
+                )
+                user_id = cursor.fetchone()['id']
+                # Уже открытые командные призы достаются и новым участникам
+                grant_global_rewards(rewards_reached('global', get_global_points(conn)), conn, user_id)
             flash('Регистрация успешна!')
             return redirect(url_for('login'))
-        except psycopg2.IntegrityError:  # PostgreSQL
-            flash('Имя занято.')
-        except sqlite3.IntegrityError:  # SQLite (локально)
+        except db.IntegrityError:
             flash('Имя занято.')
-        finally:
-            conn.close()
     return render_template('register.html')
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -692,17 +1399,34 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
+        # Лимиты проверяются до хеширования: перебор не должен занимать пул хешей
+        if not passwords.login_ip_limiter.hit(client_ip()) or not passwords.login_user_limiter.hit(username):
+            flash('Слишком много попыток. Подождите минуту.')
+            return render_template('login.html'), 429
         conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, username, password, is_admin FROM users WHERE username = %s', (username,))
+        user = cursor.fetchone()
         try:
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, username, password, is_admin FROM users WHERE username = %s', (username,))
-            user = cursor.fetchone()
-            if user and check_password_hash(user['password'], password):
-                session.update(user_id=user['id'], username=user['username'], is_admin=bool(user['is_admin']))
-                return redirect(url_for('calendar'))
-            flash('Ошибка входа.')
-        finally:
-            conn.close()
+            ok = bool(user) and passwords.verify_password(user['password'], password)
+        except passwords.Busy:
+            flash('Сервер перегружен, попробуйте через несколько секунд.')
+            return render_template('login.html'), 503
+        if ok:
+            try:
+                if passwords.needs_rehash(user['password']):
+                    # Хеш построен со старыми параметрами — пересчитываем, пока пароль известен
+                    cursor.execute(
+                        'UPDATE users SET password = %s WHERE id = %s',
+                        (passwords.hash_password(password), user['id'])
+                    )
+            except passwords.Busy:
+                # Пересчёт не обязателен для входа — повторится при следующем
+                pass
+            passwords.login_user_limiter.reset(username)
+            session.update(user_id=user['id'], username=user['username'], is_admin=bool(user['is_admin']))
+            return redirect(url_for('calendar'))
+        flash('Ошибка входа.')
     return render_template('login.html')
 
 @app.route('/logout')
@@ -710,12 +1434,25 @@ def logout():
     session.clear()
     return redirect(url_for('login'))
 
-# Запуск инициализации БД при старте приложения
+# Схему меняет python migrate.py (шаг деплоя); воркер лишь сверяет версию.
+# У SQLite шага деплоя нет — там миграции применяются при старте
+def check_schema_version():
+    conn = db.connect()
+    try:
+        if db.dialect() == 'sqlite':
+            migrate.run_migrations(conn)
+        current = migrate.current_version(conn)
+    finally:
+        conn.close()
+    latest = migrate.latest_version()
+    if current < latest:
+        print(f"⚠️ Схема БД устарела: версия {current}, последняя миграция {latest}. Запустите python migrate.py")
+    return current
+
 try:
-    init_db()
-    print("✅ База данных инициализирована.")
+    check_schema_version()
 except Exception as e:
-    print(f"❌ Ошибка инициализации БД: {e}")
+    print(f"❌ Не удалось проверить версию схемы БД: {e}")
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
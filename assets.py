@@ -0,0 +1,67 @@
+# assets.py
+import gzip
+import hashlib
+import os
+from functools import lru_cache
+
+try:
+    import brotli
+except ImportError:  # без brotli готовятся только .gz
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.html', '.txt', '.json'}
+# Папки со своими правилами: загрузки не сжимаем, временные файлы не трогаем
+SKIP_DIRS = {'uploads', '.staging'}
+# Порядок — предпочтение при выборе сжатой копии
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+# Хешируются только файлы самого приложения (стили, картинки), не загрузки
+@lru_cache(maxsize=256)
+def file_hash(path):
+    # Хеш содержимого для адреса статики; файлы статики не меняются без перезапуска.
+    # Файл читается порциями, а не целиком в память
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.file_digest(f, 'sha256').hexdigest()[:12]
+    except OSError:
+        return None
+
+
+def _fresh(source, variant):
+    return os.path.exists(variant) and os.path.getmtime(variant) >= os.path.getmtime(source)
+
+
+def compress_folder(folder):
+    # Готовит .gz (и .br, если есть brotli) рядом с текстовыми файлами; возвращает число новых копий
+    written = 0
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [name for name in dirs if name not in SKIP_DIRS]
+        for name in files:
+            if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            source = os.path.join(root, name)
+            with open(source, 'rb') as f:
+                data = f.read()
+            variants = [('.gz', lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+            if brotli is not None:
+                variants.append(('.br', lambda: brotli.compress(data, quality=11)))
+            for suffix, compress in variants:
+                if _fresh(source, source + suffix):
+                    continue
+                with open(source + suffix, 'wb') as f:
+                    f.write(compress())
+                written += 1
+    return written
+
+
+def precompressed(folder, filename, accept_encodings):
+    # (имя сжатой копии, кодировка) или (None, None), если клиенту подходит только оригинал
+    if os.path.splitext(filename)[1] not in COMPRESSIBLE_EXTENSIONS:
+        return None, None
+    source = os.path.join(folder, filename)
+    for encoding, suffix in ENCODINGS:
+        if encoding in accept_encodings and os.path.exists(source) and _fresh(source, source + suffix):
+            return filename + suffix, encoding
+    return None, None
@@ -0,0 +1,335 @@
+# bench.py
+"""Нагрузочный бенчмарк горячих маршрутов — ночь открытия новой двери.
+
+Засевает N пользователей с баллами, прогрессом и ответами, затем гоняет
+приложение через тестовый клиент Flask из нескольких потоков по сценариям
+и печатает пропускную способность, p50/p95/p99 и число запросов к БД.
+
+По умолчанию работает на временной SQLite. С --postgres использует
+DATABASE_URL — только одноразовую локальную базу: данные засеваются в неё
+и не удаляются.
+
+    python bench.py
+    python bench.py --users 2000 --threads 32 --requests 5000
+    python bench.py --scenario calendar --scenario day_view --json
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from io import BytesIO
+
+SCENARIOS = ('login', 'calendar', 'day_view', 'text_submit', 'file_submit', 'admin_approve')
+BENCH_PASSWORD = 'bench-password'
+SEED_BATCH = 500
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк календаря')
+    parser.add_argument('--users', type=int, default=500, help='сколько пользователей засеять')
+    parser.add_argument('--submissions', type=int, default=3, help='ожидающих ответов на пользователя')
+    parser.add_argument('--threads', type=int, default=16, help='параллельных клиентов')
+    parser.add_argument('--requests', type=int, default=1000, help='запросов на сценарий')
+    parser.add_argument('--approve-batch', type=int, default=20, help='ответов в одном одобрении')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='по умолчанию все')
+    parser.add_argument('--postgres', action='store_true', help='использовать DATABASE_URL')
+    parser.add_argument('--seed', type=int, default=1, help='зерно генератора случайных чисел')
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    return parser.parse_args(argv)
+
+
+def prepare_environment(args):
+    # Окружение выставляется до импорта app: от него зависят пул и хранилище
+    workdir = tempfile.mkdtemp(prefix='advent-bench-')
+    if args.postgres:
+        if 'DATABASE_URL' not in os.environ:
+            sys.exit('--postgres требует DATABASE_URL')
+    else:
+        os.environ.pop('DATABASE_URL', None)
+        os.environ['SQLITE_PATH'] = os.path.join(workdir, 'bench.db')
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    # Все виртуальные пользователи приходят с одного адреса — лимиты входа мешали бы замеру
+    os.environ['LOGIN_RATE_LIMIT_IP'] = os.environ['LOGIN_RATE_LIMIT_USER'] = '1000000/1'
+    return workdir
+
+
+def insert_rows(cursor, sql, rows, template=None):
+    import db
+    for start in range(0, len(rows), SEED_BATCH):
+        values, params = db.values_list(rows[start:start + SEED_BATCH], template)
+        cursor.execute(sql.format(values=values), params)
+
+
+def seed(app, db, args, rng):
+    """Пользователи bench_*, их баллы, открытые дни и ожидающие ответы."""
+    from werkzeug.security import generate_password_hash
+
+    conn = db.connect()
+    cursor = conn.cursor()
+    days = sorted(app._get_tasks(conn).items())
+    text_days = [day for day, task in days if task['response_type'] == 'text']
+    password = generate_password_hash(BENCH_PASSWORD)
+    usernames = [f'bench_{i}' for i in range(args.users)]
+
+    with db.transaction(conn):
+        insert_rows(cursor, '''
+            INSERT INTO users (username, password) VALUES {values}
+            ON CONFLICT (username) DO NOTHING
+        ''', [(username, password) for username in usernames])
+        cursor.execute('SELECT id FROM users WHERE username LIKE %s ORDER BY id', ('bench_%',))
+        user_ids = [row['id'] for row in cursor.fetchall()][:args.users]
+
+        entries = [
+            (user_id, rng.randrange(0, 800), rng.randrange(0, 200), None, 'bench')
+            for user_id in user_ids
+        ]
+        app.credit_points(entries, conn)
+
+        opened = [
+            (user_id, day)
+            for user_id in user_ids
+            for day in rng.sample(range(1, 32), rng.randrange(0, 15))
+        ]
+        if opened:
+            app.mark_days_opened(opened, conn)
+
+        pending = [
+            (user_id, day, f'ответ {user_id}/{day}')
+            for user_id in user_ids
+            for day in rng.sample(text_days, min(args.submissions, len(text_days)))
+        ]
+        if pending:
+            insert_rows(cursor, '''
+                INSERT INTO submissions_day (user_id, day, text_response, submitted_at, status)
+                VALUES {values}
+            ''', pending, "(%s, %s, %s, NOW(), 'pending')")
+        cursor.execute('''
+            SELECT user_id, day FROM submissions_day
+            WHERE user_id IN (SELECT id FROM users WHERE username LIKE %s)
+        ''', ('bench_%',))
+        submitted = {(row['user_id'], row['day']) for row in cursor.fetchall()}
+    conn.close()
+    return user_ids, days, submitted
+
+
+def open_all_doors(app):
+    # Бенчмарк не зависит от даты запуска: расписание последнего дня сезона, все двери открыты
+    import season
+    start = season.season_start(datetime.now(season.SEASON_TZ).date())
+    last_day = start + timedelta(days=season.SEASON_DAYS - 1)
+    season._cache = (float('inf'), season.SeasonSchedule(start, last_day))
+
+
+class QueryCounter:
+    """Считает запросы к БД в текущем потоке (тестовый клиент выполняет запрос в нём же)."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def __call__(self, sql, duration):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def value(self):
+        return getattr(self._local, 'count', 0)
+
+
+class Workload:
+    """Общие для потоков очереди: пары (пользователь, день) для ответов и id для одобрения."""
+
+    def __init__(self, db, user_ids, days, submitted, rng):
+        self.db = db
+        self.user_ids = user_ids
+        self.lock = threading.Lock()
+        free_pairs = [
+            (user_id, day, task['response_type'])
+            for user_id in user_ids
+            for day, task in days
+            if (user_id, day) not in submitted
+        ]
+        rng.shuffle(free_pairs)
+        self.text_pairs = iter([(u, d) for u, d, kind in free_pairs if kind == 'text'])
+        self.file_pairs = iter([(u, d) for u, d, kind in free_pairs if kind == 'file'])
+        self.pending_ids = None
+
+    def next_pair(self, kind):
+        with self.lock:
+            pairs = self.text_pairs if kind == 'text' else self.file_pairs
+            return next(pairs, None)
+
+    def next_pending(self, batch):
+        with self.lock:
+            if self.pending_ids is None:
+                conn = self.db.connect()
+                cursor = conn.cursor()
+                cursor.execute("SELECT id FROM submissions_day WHERE status = 'pending' ORDER BY id")
+                self.pending_ids = iter([row['id'] for row in cursor.fetchall()])
+                conn.close()
+            return list(itertools.islice(self.pending_ids, batch))
+
+
+def make_client(app, user_id=None, is_admin=False):
+    client = app.app.test_client()
+    if user_id is not None:
+        # Сессия выставляется напрямую, чтобы не платить за хеш пароля в каждом сценарии
+        with client.session_transaction() as session:
+            session.update(user_id=user_id, username=f'bench_{user_id}', is_admin=is_admin)
+    return client
+
+
+def plan_request(name, workload, rng, args):
+    """Следующий запрос сценария: (пользователь, метод, путь, параметры) или None, если очередь пуста."""
+    user_id = rng.choice(workload.user_ids)
+    if name == 'login':
+        return None, 'post', '/login', {'data': {'username': f'bench_{user_id}', 'password': BENCH_PASSWORD}}
+    if name == 'calendar':
+        return user_id, 'get', '/calendar', {}
+    if name == 'day_view':
+        return user_id, 'get', f'/day/{rng.randrange(1, 32)}', {}
+    if name == 'text_submit':
+        pair = workload.next_pair('text')
+        if pair is None:
+            return None
+        user_id, day = pair
+        return user_id, 'post', f'/day/{day}', {'data': {'text': f'бенчмарк {user_id}/{day}'}}
+    if name == 'file_submit':
+        pair = workload.next_pair('file')
+        if pair is None:
+            return None
+        user_id, day = pair
+        payload = os.urandom(rng.randrange(1024, 64 * 1024))
+        return user_id, 'post', f'/day/{day}', {
+            'data': {'file': (BytesIO(payload), f'bench_{user_id}_{day}.txt')},
+            'content_type': 'multipart/form-data',
+        }
+    ids = workload.next_pending(args.approve_batch)
+    if not ids:
+        return None
+    return 'admin', 'post', '/admin/submissions/review', {'json': {'ids': ids, 'action': 'approve'}}
+
+
+def run_scenario(name, app, workload, counter, args):
+    per_thread = [args.requests // args.threads + (1 if i < args.requests % args.threads else 0)
+                  for i in range(args.threads)]
+    latencies = []
+    queries = []
+    errors = [0]
+    results_lock = threading.Lock()
+    start_barrier = threading.Barrier(args.threads + 1)
+
+    def worker(count, seed):
+        rng = random.Random(seed)
+        # Тестовый клиент не потокобезопасен: у каждого потока свои клиенты
+        clients = {None: app.app.test_client(), 'admin': make_client(app, 0, is_admin=True)}
+        local_latencies = []
+        local_queries = []
+        local_errors = 0
+        start_barrier.wait()
+        for _ in range(count):
+            planned = plan_request(name, workload, rng, args)
+            if planned is None:
+                break
+            user_id, method, path, kwargs = planned
+            if user_id not in clients:
+                clients[user_id] = make_client(app, user_id)
+            before = counter.value()
+            started = time.perf_counter()
+            response = getattr(clients[user_id], method)(path, **kwargs)
+            local_latencies.append(time.perf_counter() - started)
+            local_queries.append(counter.value() - before)
+            if response.status_code >= 400:
+                local_errors += 1
+        with results_lock:
+            latencies.extend(local_latencies)
+            queries.extend(local_queries)
+            errors[0] += local_errors
+
+    threads = [
+        threading.Thread(target=worker, args=(count, args.seed * 1000 + i))
+        for i, count in enumerate(per_thread)
+    ]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return summarize(name, latencies, queries, errors[0], wall)
+
+
+def summarize(name, latencies, queries, errors, wall):
+    result = {'scenario': name, 'requests': len(latencies), 'errors': errors}
+    if not latencies:
+        return result
+    ms = sorted(value * 1000 for value in latencies)
+    cuts = statistics.quantiles(ms, n=100, method='inclusive') if len(ms) > 1 else [ms[0]] * 99
+    result.update(
+        throughput=round(len(ms) / wall, 1),
+        p50=round(cuts[49], 2),
+        p95=round(cuts[94], 2),
+        p99=round(cuts[98], 2),
+        max=round(ms[-1], 2),
+        queries_per_request=round(sum(queries) / len(queries), 2),
+    )
+    return result
+
+
+def print_table(results):
+    columns = ('scenario', 'requests', 'errors', 'throughput', 'p50', 'p95', 'p99', 'max', 'queries_per_request')
+    headers = ('сценарий', 'запросов', 'ошибок', 'rps', 'p50 мс', 'p95 мс', 'p99 мс', 'max мс', 'SQL/запрос')
+    rows = [[str(result.get(column, '-')) for column in columns] for result in results]
+    widths = [max(len(header), *(len(row[i]) for row in rows)) for i, header in enumerate(headers)]
+    print('  '.join(header.ljust(width) for header, width in zip(headers, widths)))
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    prepare_environment(args)
+
+    # Сообщения о миграциях не должны попадать в вывод --json
+    with contextlib.redirect_stdout(sys.stderr):
+        import app
+        import db
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    user_ids, days, submitted = seed(app, db, args, rng)
+    seeded_in = time.perf_counter() - started
+    open_all_doors(app)
+
+    counter = QueryCounter()
+    db.query_hooks.append(counter)
+    workload = Workload(db, user_ids, days, submitted, rng)
+
+    results = [
+        run_scenario(name, app, workload, counter, args)
+        for name in (args.scenario or SCENARIOS)
+    ]
+
+    if args.json:
+        print(json.dumps({
+            'backend': db.dialect(),
+            'users': len(user_ids),
+            'threads': args.threads,
+            'seeded_in': round(seeded_in, 2),
+            'results': results,
+        }, ensure_ascii=False, indent=2))
+    else:
+        print(f'Бэкенд: {db.dialect()}, пользователей: {len(user_ids)}, потоков: {args.threads}, '
+              f'засев за {seeded_in:.1f} с')
+        print_table(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
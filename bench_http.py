@@ -0,0 +1,249 @@
+# bench_http.py
+"""Бенчмарк режима gunicorn: медленные клиенты против календаря.
+
+Засевает базу как bench.py, затем для каждого класса воркеров поднимает
+gunicorn с gunicorn.conf.py на локальном порту и гоняет по HTTP:
+
+- mixed — календарь и страницы дней из нескольких потоков;
+- slow_clients — то же, пока медленные клиенты по капле загружают фото.
+
+Печатает rps, p50/p95/p99 быстрых запросов и сколько медленных загрузок
+дошло. Результаты для sync и gthread приведены в gunicorn.conf.py.
+
+    python bench_http.py
+    python bench_http.py --worker-class sync --worker-class gthread --slow-clients 16
+    python bench_http.py --worker-class gevent  # нужны gevent и psycogreen
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import bench
+
+WORKER_CLASSES = ('sync', 'gthread', 'gevent')
+WORKLOADS = ('mixed', 'slow_clients')
+BOUNDARY = 'bench-http-boundary'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарк воркеров gunicorn')
+    parser.add_argument('--worker-class', action='append', choices=WORKER_CLASSES,
+                        help='по умолчанию sync и gthread')
+    parser.add_argument('--workload', action='append', choices=WORKLOADS, help='по умолчанию обе')
+    parser.add_argument('--workers', type=int, default=2, help='процессов gunicorn')
+    parser.add_argument('--threads', type=int, default=8, help='потоков на воркер gthread')
+    parser.add_argument('--users', type=int, default=200, help='сколько пользователей засеять')
+    parser.add_argument('--requests', type=int, default=400, help='быстрых запросов на нагрузку')
+    parser.add_argument('--clients', type=int, default=8, help='потоков быстрых запросов')
+    parser.add_argument('--slow-clients', type=int, default=8, help='медленных загрузок')
+    parser.add_argument('--slow-size', type=int, default=48 * 1024, help='размер загрузки, байт')
+    parser.add_argument('--slow-rate', type=int, default=4 * 1024, help='скорость загрузки, байт/с')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=1, help='зерно генератора случайных чисел')
+    parser.add_argument('--json', action='store_true', help='вывести результаты в JSON')
+    args = parser.parse_args(argv)
+    # Поля, которые ждут функции bench.py
+    args.postgres = False
+    args.submissions = 3
+    return args
+
+
+def create_app():
+    # Точка входа воркеров gunicorn: приложение с открытыми дверями, как в bench.py
+    import app
+    bench.open_all_doors(app)
+    return app.app
+
+
+@contextlib.contextmanager
+def serve(worker_class, args):
+    # Класс воркеров — через окружение: от него зависят умолчания пула и /events в конфиге
+    env = dict(
+        os.environ, GUNICORN_ACCESS_LOG='', GUNICORN_WORKER_CLASS=worker_class,
+        WEB_CONCURRENCY=str(args.workers), GUNICORN_THREADS=str(args.threads),
+    )
+    command = [
+        sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+        '--bind', f'127.0.0.1:{args.port}', 'bench_http:create_app()',
+    ]
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', args.port), timeout=1).close()
+                break
+            except OSError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f'gunicorn ({worker_class}) не запустился')
+                time.sleep(0.2)
+        yield
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def session_cookie(app, user_id):
+    serializer = app.app.session_interface.get_signing_serializer(app.app)
+    value = serializer.dumps({'user_id': user_id, 'username': f'bench_{user_id}', 'is_admin': False})
+    return f"{app.app.config['SESSION_COOKIE_NAME']}={value}"
+
+
+def slow_upload(args, cookie, day, results):
+    # Загрузка фото по капле: заголовки сразу, тело — порциями с заданной скоростью
+    head = (
+        f'--{BOUNDARY}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="slow_{day}.txt"\r\n'
+        'Content-Type: text/plain\r\n\r\n'
+    ).encode()
+    body = head + os.urandom(args.slow_size) + f'\r\n--{BOUNDARY}--\r\n'.encode()
+    request = (
+        f'POST /day/{day} HTTP/1.1\r\n'
+        f'Host: 127.0.0.1:{args.port}\r\n'
+        f'Cookie: {cookie}\r\n'
+        f'Content-Type: multipart/form-data; boundary={BOUNDARY}\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        'Connection: close\r\n\r\n'
+    ).encode()
+    chunk = max(1, args.slow_rate // 4)
+    started = time.perf_counter()
+    try:
+        with socket.create_connection(('127.0.0.1', args.port), timeout=120) as sock:
+            sock.sendall(request)
+            for offset in range(0, len(body), chunk):
+                sock.sendall(body[offset:offset + chunk])
+                time.sleep(0.25)
+            status = sock.recv(64).split(b' ', 2)[1]
+        results.append((int(status) < 400, time.perf_counter() - started))
+    except (OSError, IndexError, ValueError):
+        results.append((False, time.perf_counter() - started))
+
+
+def fast_requests(app, args, user_ids, count, seed, latencies, errors, lock):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection('127.0.0.1', args.port, timeout=120)
+    local_latencies = []
+    local_errors = 0
+    for _ in range(count):
+        path = '/calendar' if rng.random() < 0.5 else f'/day/{rng.randrange(1, 32)}'
+        headers = {'Cookie': session_cookie(app, rng.choice(user_ids))}
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                local_errors += 1
+        except (OSError, http.client.HTTPException):
+            local_errors += 1
+            conn.close()
+        local_latencies.append(time.perf_counter() - started)
+    conn.close()
+    with lock:
+        latencies.extend(local_latencies)
+        errors[0] += local_errors
+
+
+def run_workload(name, worker_class, app, workload, args):
+    slow_results = []
+    slow_threads = []
+    if name == 'slow_clients':
+        for _ in range(args.slow_clients):
+            pair = workload.next_pair('file')
+            if pair is None:
+                break
+            user_id, day = pair
+            thread = threading.Thread(target=slow_upload, args=(args, session_cookie(app, user_id), day, slow_results))
+            thread.start()
+            slow_threads.append(thread)
+        # Медленные клиенты успевают занять воркеры до начала замера
+        time.sleep(1)
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_thread = [args.requests // args.clients + (1 if i < args.requests % args.clients else 0)
+                  for i in range(args.clients)]
+    threads = [
+        threading.Thread(target=fast_requests, args=(
+            app, args, workload.user_ids, count, args.seed * 1000 + i, latencies, errors, lock))
+        for i, count in enumerate(per_thread)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    for thread in slow_threads:
+        thread.join()
+
+    result = {'workers': worker_class, 'workload': name, 'requests': len(latencies), 'errors': errors[0]}
+    if latencies:
+        ms = sorted(value * 1000 for value in latencies)
+        cuts = statistics.quantiles(ms, n=100, method='inclusive') if len(ms) > 1 else [ms[0]] * 99
+        result.update(
+            throughput=round(len(ms) / wall, 1),
+            p50=round(cuts[49], 1),
+            p95=round(cuts[94], 1),
+            p99=round(cuts[98], 1),
+        )
+    if slow_threads:
+        result['slow_done'] = f'{sum(ok for ok, _ in slow_results)}/{len(slow_threads)}'
+    return result
+
+
+def print_table(results):
+    columns = ('workers', 'workload', 'requests', 'errors', 'throughput', 'p50', 'p95', 'p99', 'slow_done')
+    headers = ('воркеры', 'нагрузка', 'запросов', 'ошибок', 'rps', 'p50 мс', 'p95 мс', 'p99 мс', 'загрузок')
+    rows = [[str(result.get(column, '-')) for column in columns] for result in results]
+    widths = [max(len(header), *(len(row[i]) for row in rows)) for i, header in enumerate(headers)]
+    print('  '.join(header.ljust(width) for header, width in zip(headers, widths)))
+    for row in rows:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    bench.prepare_environment(args)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        import app
+        import db
+
+    rng = random.Random(args.seed)
+    user_ids, days, submitted = bench.seed(app, db, args, rng)
+    workload = bench.Workload(db, user_ids, days, submitted, rng)
+
+    results = []
+    for worker_class in args.worker_class or ('sync', 'gthread'):
+        with serve(worker_class, args):
+            for name in args.workload or WORKLOADS:
+                results.append(run_workload(name, worker_class, app, workload, args))
+
+    if args.json:
+        print(json.dumps({
+            'backend': db.dialect(),
+            'workers': args.workers,
+            'threads': args.threads,
+            'results': results,
+        }, ensure_ascii=False, indent=2))
+    else:
+        print(f'Бэкенд: {db.dialect()}, воркеров: {args.workers}, потоков gthread: {args.threads}, '
+              f'медленных загрузок: {args.slow_clients} по {args.slow_size // 1024} КиБ '
+              f'со скоростью {args.slow_rate // 1024} КиБ/с')
+        print_table(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
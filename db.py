@@ -0,0 +1,377 @@
+# db.py
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import lru_cache
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import DictCursor
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+
+# Размер пула и время ожидания свободного соединения (секунды)
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+# Без DATABASE_URL работаем со встроенной SQLite (один сервер, без сети до БД)
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'database.db')
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # миллисекунды
+# Общий кеш страниц между соединениями процесса. По умолчанию выключен: при нём
+# конфликт блокировок таблиц даёт SQLITE_LOCKED, который busy_timeout не ждёт
+SQLITE_SHARED_CACHE = os.environ.get('SQLITE_SHARED_CACHE') == '1'
+
+IntegrityError = (psycopg2.IntegrityError, sqlite3.IntegrityError)
+Error = (psycopg2.Error, sqlite3.Error)
+
+
+# Подписчики hook(sql, duration) вызываются после каждого запроса (бенчмарк, профилирование).
+# Пока список пуст, курсоры не замеряют время
+query_hooks = []
+
+
+def _notify(sql, started):
+    duration = time.perf_counter() - started
+    for hook in query_hooks:
+        hook(sql, duration)
+
+
+class DictCursorWithHooks(DictCursor):
+    def execute(self, query, vars=None):
+        if not query_hooks:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _notify(query, started)
+
+    def executemany(self, query, vars_list):
+        if not query_hooks:
+            return super().executemany(query, vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _notify(query, started)
+
+
+def dialect():
+    return 'postgres' if 'DATABASE_URL' in os.environ else 'sqlite'
+
+
+# --- SQLite ---
+# Запросы приложения пишутся для PostgreSQL; для SQLite они переводятся на лету
+_SQLITE_REWRITES = [
+    (re.compile(r'%\((\w+)\)s'), r':\1'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'%%'), '%'),
+    (re.compile(r'\bNOW\(\)'), 'CURRENT_TIMESTAMP'),
+    (re.compile(r'\bLEAST\s*\('), 'MIN('),
+    (re.compile(r'\bGREATEST\s*\('), 'MAX('),
+    (re.compile(r'\bSERIAL PRIMARY KEY\b'), 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    (re.compile(r'\s+FOR UPDATE\b'), ''),
+    # Блокировку на запись берём сразу, иначе две транзакции упрутся друг в друга
+    # при повышении блокировки, и busy_timeout не поможет
+    (re.compile(r'^\s*BEGIN\s*$'), 'BEGIN IMMEDIATE'),
+]
+
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    for pattern, replacement in _SQLITE_REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def _parse_timestamp(value):
+    return datetime.fromisoformat(value.decode())
+
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('TIMESTAMP', _parse_timestamp)
+
+
+class SQLiteCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, sql, params=()):
+        if not query_hooks:
+            self._cursor.execute(translate(sql), params)
+            return self
+        started = time.perf_counter()
+        try:
+            self._cursor.execute(translate(sql), params)
+        finally:
+            _notify(sql, started)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        if not query_hooks:
+            self._cursor.executemany(translate(sql), seq_of_params)
+            return self
+        started = time.perf_counter()
+        try:
+            self._cursor.executemany(translate(sql), seq_of_params)
+        finally:
+            _notify(sql, started)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self._cursor.arraysize)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """Соединение SQLite с интерфейсом, которого ждёт приложение: курсор
+    понимает плейсхолдеры psycopg2, транзакции — только явные (autocommit)."""
+
+    autocommit = True
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.closed = False
+
+    def cursor(self):
+        return SQLiteCursor(self._conn.cursor())
+
+    def commit(self):
+        # Вне явной транзакции ничего не делает — как commit() у psycopg2 в autocommit
+        self._conn.commit()
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def close(self):
+        if not self.closed:
+            self._conn.close()
+            self.closed = True
+
+
+def connect_sqlite(path=SQLITE_PATH):
+    uri = f'file:{path}' + ('?cache=shared' if SQLITE_SHARED_CACHE else '')
+    conn = sqlite3.connect(
+        uri, uri=True,
+        timeout=SQLITE_BUSY_TIMEOUT / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+        detect_types=sqlite3.PARSE_DECLTYPES,
+    )
+    conn.row_factory = sqlite3.Row
+    # Настройки один раз на соединение; соединения живут в пуле
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return SQLiteConnection(conn)
+
+
+class SQLiteConnections:
+    """Хранилище простаивающих соединений SQLite с интерфейсом ThreadedConnectionPool."""
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def getconn(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return connect_sqlite(self.path)
+
+    def putconn(self, conn, close=False):
+        if close:
+            conn.close()
+            return
+        with self._lock:
+            self._idle.append(conn)
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+
+# --- Пул ---
+class ConnectionPool:
+    """Потокобезопасный пул соединений со статистикой ожиданий.
+
+    ThreadedConnectionPool сам по себе не ждёт свободного соединения, а сразу
+    бросает PoolError, поэтому число выданных соединений ограничивается семафором.
+    Для SQLite вместо него передаётся SQLiteConnections.
+    """
+
+    def __init__(self, dsn=None, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT,
+                 connections=None):
+        if connections is None:
+            connections = ThreadedConnectionPool(minconn, maxconn, dsn, cursor_factory=DictCursorWithHooks)
+        self._pool = connections
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.timeouts = 0
+
+    def getconn(self):
+        if not self._slots.acquire(blocking=False):
+            # Все соединения заняты — ждём и учитываем ожидание в статистике
+            started = time.monotonic()
+            acquired = self._slots.acquire(timeout=self.timeout)
+            waited = time.monotonic() - started
+            with self._lock:
+                self.waits += 1
+                self.wait_time += waited
+                if not acquired:
+                    self.timeouts += 1
+            if not acquired:
+                raise PoolError(f'Нет свободных соединений за {self.timeout} с')
+
+        try:
+            conn = self._pool.getconn()
+            if conn.closed:
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+            if not conn.autocommit:
+                conn.set_session(autocommit=True)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+        return conn
+
+    def putconn(self, conn):
+        close = bool(conn.closed)
+        if not close and in_transaction(conn):
+            # Незавершённую транзакцию откатываем, сломанное соединение закрываем
+            try:
+                conn.cursor().execute('ROLLBACK')
+            except Error:
+                close = True
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max': self.maxconn,
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time': round(self.wait_time, 4),
+                'timeouts': self.timeouts,
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # Пул создаётся лениво в каждом процессе (воркере gunicorn) отдельно
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                if dialect() == 'postgres':
+                    _pool = ConnectionPool(os.environ['DATABASE_URL'])
+                else:
+                    _pool = ConnectionPool(connections=SQLiteConnections())
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def connect():
+    # Отдельное соединение вне пула — для миграций и служебных команд
+    if dialect() == 'sqlite':
+        return connect_sqlite()
+    conn = psycopg2.connect(os.environ['DATABASE_URL'], cursor_factory=DictCursorWithHooks)
+    conn.set_session(autocommit=True)
+    return conn
+
+
+def in_transaction(conn):
+    if isinstance(conn, extensions.connection):
+        return conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE
+    return conn.in_transaction
+
+
+@contextmanager
+def transaction(conn):
+    # Явная транзакция поверх autocommit-соединения; вложенный вызов присоединяется к внешней
+    if in_transaction(conn):
+        yield conn
+        return
+    cursor = conn.cursor()
+    cursor.execute('BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        cursor.execute('ROLLBACK')
+        raise
+    cursor.execute('COMMIT')
+
+
+def iter_rows(conn, sql, params=(), itersize=1000):
+    # Построчное чтение большой выборки: память не растёт с числом строк.
+    # В PostgreSQL — серверный (именованный) курсор, ему нужна транзакция
+    if dialect() == 'sqlite':
+        cursor = conn.cursor().execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(itersize)
+            if not rows:
+                return
+            yield from rows
+    with transaction(conn):
+        cursor = conn.cursor(name=f'iter_rows_{id(conn)}_{time.monotonic_ns()}')
+        cursor.itersize = itersize
+        try:
+            cursor.execute(sql, params)
+            yield from cursor
+        finally:
+            cursor.close()
+
+
+def values_list(rows, template=None):
+    # Многострочный VALUES для одного INSERT: '(%s, %s), (%s, %s)' и плоский список параметров
+    rows = list(rows)
+    if template is None:
+        template = '(' + ', '.join(['%s'] * len(rows[0])) + ')'
+    return ', '.join([template] * len(rows)), [value for row in rows for value in row]
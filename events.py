@@ -0,0 +1,145 @@
+# events.py
+"""Живые обновления через server-sent events.
+
+Приложение публикует события (изменение общего счёта, проверка ответа) в
+канал; брокер раскладывает их по очередям открытых потоков /events этого
+воркера. Между воркерами события передаёт транспорт: LocalTransport
+доставляет только внутри процесса и подменяется общим (LISTEN/NOTIFY, Redis)
+без изменений в коде публикации.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+EVENTS_TRANSPORT = os.environ.get('EVENTS_TRANSPORT', 'local')
+# Поток закрывается через это время, браузер переподключается сам — воркер не занят навечно
+EVENTS_MAX_DURATION = float(os.environ.get('EVENTS_MAX_DURATION', 55))
+EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', 15))
+# Потоков на воркер; 0 — живые обновления выключены (поток держит воркер sync целиком)
+EVENTS_MAX_CLIENTS = int(os.environ.get('EVENTS_MAX_CLIENTS', 0))
+EVENTS_QUEUE_SIZE = 100
+EVENTS_RETRY_MS = 3000
+
+
+class Broker:
+    """Подписки открытых потоков этого процесса по каналам."""
+
+    def __init__(self, max_clients=EVENTS_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._channels = {}
+        self._clients = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels):
+        # None — лимит потоков на воркер исчерпан
+        with self._lock:
+            if self._clients >= self.max_clients:
+                return None
+            self._clients += 1
+            inbox = queue.Queue(maxsize=EVENTS_QUEUE_SIZE)
+            for channel in channels:
+                self._channels.setdefault(channel, set()).add(inbox)
+        return inbox
+
+    def unsubscribe(self, inbox, channels):
+        with self._lock:
+            self._clients -= 1
+            for channel in channels:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(inbox)
+                    if not subscribers:
+                        del self._channels[channel]
+
+    def deliver(self, channel, event, data):
+        with self._lock:
+            inboxes = list(self._channels.get(channel, ()))
+        for inbox in inboxes:
+            try:
+                inbox.put_nowait((event, data))
+            except queue.Full:
+                # Медленный клиент теряет событие, а не тормозит публикацию
+                pass
+
+    def clients(self):
+        with self._lock:
+            return self._clients
+
+
+class LocalTransport:
+    """Доставка в пределах одного процесса — замена общей шины для одного воркера и разработки."""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, channel, event, data):
+        self.broker.deliver(channel, event, data)
+
+
+TRANSPORTS = {
+    'local': LocalTransport,
+}
+
+broker = Broker()
+transport = TRANSPORTS[EVENTS_TRANSPORT](broker)
+
+
+def publish(channel, event, data):
+    transport.publish(channel, event, data)
+
+
+def enabled():
+    # Постоянный признак конфигурации воркера — в отличие от available(), годится для ETag
+    return broker.max_clients > 0
+
+
+def available():
+    # Страница открывает поток, только если он включён и у воркера есть свободное место:
+    # на 503 EventSource не переподключается, так что попытка была бы лишним запросом
+    return broker.max_clients > 0 and broker.clients() < broker.max_clients
+
+
+def format_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+class EventStream:
+    """Тело ответа text/event-stream. Подписка снимается при закрытии ответа,
+    даже если клиент ушёл раньше, чем началась отдача."""
+
+    def __init__(self, inbox, channels):
+        self.inbox = inbox
+        self.channels = channels
+        self._closed = False
+
+    def __iter__(self):
+        try:
+            yield f'retry: {EVENTS_RETRY_MS}\n\n'
+            deadline = time.monotonic() + EVENTS_MAX_DURATION
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    event, data = self.inbox.get(timeout=min(EVENTS_HEARTBEAT, remaining))
+                except queue.Empty:
+                    yield ': ping\n\n'
+                    continue
+                yield format_event(event, data)
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            broker.unsubscribe(self.inbox, self.channels)
+
+
+def stream(channels):
+    # None — потоков на воркер слишком много
+    inbox = broker.subscribe(channels)
+    if inbox is None:
+        return None
+    return EventStream(inbox, channels)
@@ -0,0 +1,113 @@
+# fragments.py
+"""Кеш отрендеренных кусков страниц.
+
+Сетка календаря и таблицы призов одинаковы у всех, чьё состояние совпадает
+(день сезона, открытые двери, число достигнутых целей), поэтому HTML
+рендерится один раз на ключ. Первый уровень — LRU в памяти воркера, второй
+(FRAGMENT_CACHE=redis) — общий для всех воркеров и экземпляров.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+try:
+    import redis
+except ImportError:  # общий кеш на Redis недоступен, работает только LRU воркера
+    redis = None
+
+FRAGMENT_CACHE = os.environ.get('FRAGMENT_CACHE', 'local')
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 1024))
+FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+
+
+class LocalCache:
+    """LRU с временем жизни записей в памяти процесса."""
+
+    def __init__(self, maxsize=FRAGMENT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] <= time.monotonic():
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._items), 'hits': self.hits, 'misses': self.misses}
+
+
+class RedisCache:
+    """Общий кеш фрагментов в Redis (REDIS_URL)."""
+
+    def __init__(self):
+        if redis is None:
+            raise RuntimeError('FRAGMENT_CACHE=redis требует пакет redis')
+        self.client = redis.Redis.from_url(os.environ['REDIS_URL'])
+
+    def get(self, key):
+        # Недоступный Redis — промах, а не ошибка страницы
+        try:
+            value = self.client.get('fragment:' + key)
+        except redis.RedisError:
+            return None
+        return value.decode() if value is not None else None
+
+    def set(self, key, value, ttl):
+        try:
+            self.client.set('fragment:' + key, value.encode(), ex=ttl)
+        except redis.RedisError:
+            pass
+
+
+BACKENDS = {
+    'redis': RedisCache,
+}
+
+local = LocalCache()
+_shared = None
+_shared_pid = None
+
+
+def get_shared():
+    # Общий бэкенд (соединение) создаётся в каждом воркере заново; None — только локальный LRU
+    global _shared, _shared_pid
+    if FRAGMENT_CACHE == 'local':
+        return None
+    if _shared is None or _shared_pid != os.getpid():
+        _shared = BACKENDS[FRAGMENT_CACHE]()
+        _shared_pid = os.getpid()
+    return _shared
+
+
+def cached(key, render, ttl=FRAGMENT_CACHE_TTL):
+    # HTML фрагмента по ключу; render() вызывается только при промахе обоих уровней
+    value = local.get(key)
+    if value is None:
+        shared = get_shared()
+        if shared is not None:
+            value = shared.get(key)
+        if value is None:
+            value = str(render())
+            if shared is not None:
+                shared.set(key, value, ttl)
+        local.set(key, value, ttl)
+    return Markup(value)
@@ -0,0 +1,76 @@
+# gunicorn.conf.py
+"""Настройки gunicorn: gunicorn -c gunicorn.conf.py app:app
+
+По умолчанию воркеры gthread: запрос занимает поток, а не весь процесс,
+поэтому медленная загрузка фото с телефона не останавливает календарь для
+остальных. GUNICORN_WORKER_CLASS=gevent даёт тысячи соединений на воркер
+(psycopg2 переводится в неблокирующий режим через psycogreen — см. ниже).
+
+Живые обновления (/events) включены только под gevent: поток держит
+соединение до EVENTS_MAX_DURATION, и у gthread восемь потоков на воркер
+хватило бы на четыре вкладки, а остальным браузерам /events отвечал бы 503,
+после которого EventSource не переподключается. Под gthread и sync
+EVENTS_MAX_CLIENTS=0 — календарь обновляется перезагрузкой, когда
+открывается следующая дверь. Явный EVENTS_MAX_CLIENTS в окружении
+перекрывает это умолчание.
+
+Соединения с БД: пул на воркер (DB_POOL_MAX) по умолчанию равен числу
+потоков, так что каждый поток получает соединение без ожидания; под gevent
+пул меньше числа соединений, и лишние запросы ждут в очереди пула до
+DB_POOL_TIMEOUT. Загрузка дочитывается до взятия соединения из пула.
+
+Сравнение (python bench_http.py: 1 CPU, SQLite, 2 воркера, 8 потоков
+gthread; 400 запросов календаря и дней из 8 потоков; в slow_clients
+параллельно 8 загрузок по 48 КиБ со скоростью 4 КиБ/с, ~12 с каждая):
+
+    воркеры   нагрузка       rps     p50 мс   p95 мс   p99 мс    загрузок
+    sync      mixed          212.5   27.7     39.8     462.1     -
+    sync      slow_clients   33.0    19.8     33.3     11063.7   8/8
+    gthread   mixed          266.0   18.5     38.0     475.4     -
+    gthread   slow_clients   430.4   16.5     32.4     42.0      8/8
+
+С sync медленные загрузки занимают оба воркера, и запросы календаря ждут
+их окончания; с gthread загрузка занимает один поток из восьми. Хвост p99
+в mixed — первые запросы воркера (компиляция шаблонов). gevent здесь не
+замерялся (python bench_http.py --worker-class gevent).
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+# Больше одного потока превращает sync в gthread, поэтому потоки — только для gthread
+threads = int(os.environ.get('GUNICORN_THREADS', 8)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+# У gthread и gevent таймаут — это молчание воркера, а не длина запроса, но для sync
+# он должен пережить поток /events (EVENTS_MAX_DURATION) и медленную загрузку
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# Перезапуск воркеров ограничивает рост памяти; разброс — чтобы не все сразу
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+# Сердцебиение воркеров в памяти, а не на диске контейнера
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# Пустое значение выключает журнал запросов
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+
+# Значения по умолчанию для приложения: воркер импортирует app уже после чтения конфига.
+# Потоки /events открываются только под gevent, у остальных EVENTS_MAX_CLIENTS остаётся 0
+if worker_class == 'gevent':
+    os.environ.setdefault('DB_POOL_MAX', '20')
+    os.environ.setdefault('EVENTS_MAX_CLIENTS', str(worker_connections // 2))
+elif worker_class == 'gthread':
+    os.environ.setdefault('DB_POOL_MAX', str(threads))
+
+
+def post_worker_init(worker):
+    # Под gevent psycopg2 должен уступать управление, пока ждёт ответа базы
+    if worker.cfg.worker_class_str == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
@@ -0,0 +1,152 @@
+# metrics.py
+"""Профилирование запросов: включается переменной REQUEST_METRICS=1.
+
+На каждый HTTP-запрос считаются число SQL-запросов, время в БД, время
+получения соединения и рендеринга шаблонов. Итог отдаётся заголовком
+Server-Timing и строкой JSON в лог, а гистограммы по маршрутам и примеры
+медленных запросов копятся в памяти воркера для /admin/metrics.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+
+import db
+
+ENABLED = os.environ.get('REQUEST_METRICS') == '1'
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_QUERY_SAMPLES = int(os.environ.get('SLOW_QUERY_SAMPLES', 50))
+# Верхние границы корзин гистограммы, мс; последняя корзина — всё, что дольше
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+log = logging.getLogger('advent.metrics')
+
+_lock = threading.Lock()
+_routes = {}
+_slow_queries = deque(maxlen=SLOW_QUERY_SAMPLES)
+
+
+def _current():
+    if not has_request_context():
+        return None
+    return g.get('metrics')
+
+
+def record(kind, duration):
+    # kind: 'conn' или 'template'; вне запроса и при выключенных метриках ничего не делает
+    current = _current()
+    if current is not None:
+        current[kind] += duration
+
+
+def _on_query(sql, duration):
+    current = _current()
+    if current is None:
+        return
+    current['queries'] += 1
+    current['db'] += duration
+    if duration * 1000 >= SLOW_QUERY_MS:
+        with _lock:
+            _slow_queries.append({
+                'route': request.endpoint,
+                'ms': round(duration * 1000, 2),
+                'sql': ' '.join(sql.split())[:500],
+                'at': time.time(),
+            })
+
+
+def _before_request():
+    g.metrics = {'started': time.perf_counter(), 'queries': 0, 'db': 0.0, 'conn': 0.0, 'template': 0.0}
+
+
+def _before_render(sender, template, context, **extra):
+    current = _current()
+    if current is not None:
+        current['template_started'] = time.perf_counter()
+
+
+def _template_rendered(sender, template, context, **extra):
+    current = _current()
+    if current is not None and 'template_started' in current:
+        record('template', time.perf_counter() - current.pop('template_started'))
+
+
+def _observe(route, total_ms, current):
+    with _lock:
+        stats = _routes.get(route)
+        if stats is None:
+            stats = _routes[route] = {
+                'count': 0, 'total_ms': 0.0, 'db_ms': 0.0, 'queries': 0,
+                'buckets': [0] * (len(BUCKETS_MS) + 1),
+            }
+        stats['count'] += 1
+        stats['total_ms'] += total_ms
+        stats['db_ms'] += current['db'] * 1000
+        stats['queries'] += current['queries']
+        stats['buckets'][bisect_left(BUCKETS_MS, total_ms)] += 1
+
+
+def _after_request(response):
+    current = g.pop('metrics', None)
+    if current is None:
+        return response
+    total_ms = (time.perf_counter() - current['started']) * 1000
+    route = request.endpoint or 'unknown'
+    _observe(route, total_ms, current)
+
+    response.headers['Server-Timing'] = ', '.join([
+        f'db;dur={current["db"] * 1000:.2f};desc="{current["queries"]} queries"',
+        f'conn;dur={current["conn"] * 1000:.2f}',
+        f'tpl;dur={current["template"] * 1000:.2f}',
+        f'total;dur={total_ms:.2f}',
+    ])
+    log.info(json.dumps({
+        'method': request.method,
+        'path': request.path,
+        'route': route,
+        'status': response.status_code,
+        'ms': round(total_ms, 2),
+        'queries': current['queries'],
+        'db_ms': round(current['db'] * 1000, 2),
+        'conn_ms': round(current['conn'] * 1000, 2),
+        'template_ms': round(current['template'] * 1000, 2),
+    }, ensure_ascii=False))
+    return response
+
+
+def snapshot():
+    # Данные одного воркера: у каждого процесса gunicorn свои счётчики
+    with _lock:
+        routes = {}
+        for route, stats in _routes.items():
+            routes[route] = {
+                'count': stats['count'],
+                'avg_ms': round(stats['total_ms'] / stats['count'], 2),
+                'avg_db_ms': round(stats['db_ms'] / stats['count'], 2),
+                'avg_queries': round(stats['queries'] / stats['count'], 2),
+                # Пары [верхняя граница, число запросов] в порядке возрастания
+                'histogram_ms': [list(pair) for pair in zip(BUCKETS_MS + ('inf',), stats['buckets'])],
+            }
+        return {
+            'pid': os.getpid(),
+            'routes': routes,
+            'slow_queries': list(_slow_queries),
+        }
+
+
+def init_app(app):
+    if not ENABLED:
+        return
+    if not log.handlers and not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO)
+    log.setLevel(logging.INFO)
+    db.query_hooks.append(_on_query)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_template_rendered, app)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
@@ -0,0 +1,140 @@
+# migrate.py
+"""Применяет версионные миграции схемы из папки migrations/.
+
+Файлы называются NNNN_описание.sql или NNNN_описание.py (с функцией
+upgrade(cursor)) и применяются по порядку номеров, каждый в своей транзакции.
+Номер последней применённой миграции хранится в таблице schema_version.
+Если для SQLite нужен другой текст, рядом кладётся NNNN_описание.sqlite.sql;
+остальные миграции переводятся на диалект SQLite курсором из db.py.
+
+    python migrate.py            # применить все новые миграции
+    python migrate.py --status   # показать текущую и последнюю версии
+    python migrate.py --target 5 # применить миграции до версии 5 включительно
+"""
+import argparse
+import importlib.util
+import os
+import re
+import sys
+
+import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATION_NAME = re.compile(r'^(\d{4})_(\w+?)(\.sqlite)?\.(sql|py)$')
+# Ключ advisory-блокировки: два одновременных деплоя не применяют миграции дважды
+MIGRATION_LOCK_ID = 20260101
+
+
+def discover(directory=MIGRATIONS_DIR, dialect=None):
+    dialect = dialect or db.dialect()
+    migrations = {}
+    variants = {}
+    for filename in sorted(os.listdir(directory)):
+        match = MIGRATION_NAME.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1))
+        entry = (version, filename, os.path.join(directory, filename))
+        if match.group(3):
+            if dialect == 'sqlite':
+                variants[version] = entry
+            continue
+        if version in migrations:
+            raise RuntimeError(f'Две миграции с номером {version}: {migrations[version][1]} и {filename}')
+        migrations[version] = entry
+    migrations.update(variants)
+    return [migrations[version] for version in sorted(migrations)]
+
+
+def latest_version():
+    migrations = discover()
+    return migrations[-1][0] if migrations else 0
+
+
+def ensure_version_table(conn):
+    conn.cursor().execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    ''')
+
+
+def current_version(conn):
+    ensure_version_table(conn)
+    cursor = conn.cursor()
+    cursor.execute('SELECT COALESCE(MAX(version), 0) AS version FROM schema_version')
+    return cursor.fetchone()['version']
+
+
+def split_statements(sql):
+    # Операторы разделяются ';' в конце строки; строки-комментарии отбрасываются
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    statements = re.split(r';\s*$', '\n'.join(lines), flags=re.MULTILINE)
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def apply(conn, path):
+    cursor = conn.cursor()
+    if path.endswith('.sql'):
+        with open(path, encoding='utf-8') as f:
+            for statement in split_statements(f.read()):
+                cursor.execute(statement)
+    else:
+        spec = importlib.util.spec_from_file_location(os.path.basename(path)[:-3], path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        module.upgrade(cursor)
+
+
+def run_migrations(conn, target=None):
+    cursor = conn.cursor()
+    locking = db.dialect() == 'postgres'
+    if locking:
+        cursor.execute('SELECT pg_advisory_lock(%s)', (MIGRATION_LOCK_ID,))
+    try:
+        current = current_version(conn)
+        applied = []
+        for version, filename, path in discover():
+            if version <= current or (target is not None and version > target):
+                continue
+            with db.transaction(conn):
+                # Версию перепроверяем внутри транзакции: миграции могли применить параллельно
+                cursor.execute('SELECT 1 FROM schema_version WHERE version = %s', (version,))
+                if cursor.fetchone():
+                    continue
+                apply(conn, path)
+                cursor.execute(
+                    'INSERT INTO schema_version (version, name) VALUES (%s, %s)',
+                    (version, filename)
+                )
+            applied.append(filename)
+            print(f'✅ Применена миграция {filename}')
+        return applied
+    finally:
+        if locking:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', (MIGRATION_LOCK_ID,))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Миграции схемы БД')
+    parser.add_argument('--status', action='store_true', help='только показать версии')
+    parser.add_argument('--target', type=int, help='применить миграции до этой версии')
+    args = parser.parse_args(argv)
+
+    conn = db.connect()
+    try:
+        if args.status:
+            print(f'Версия схемы: {current_version(conn)}, последняя миграция: {latest_version()}')
+            return 0
+        applied = run_migrations(conn, args.target)
+        if not applied:
+            print('✅ Схема БД актуальна.')
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
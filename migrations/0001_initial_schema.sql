@@ -0,0 +1,60 @@
+-- Исходная схема календаря (IF NOT EXISTS — базы, созданные старым init_db, уже содержат эти таблицы)
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    is_admin INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS progress (
+    user_id INTEGER,
+    day INTEGER,
+    opened_at TIMESTAMP,
+    PRIMARY KEY (user_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS tasks (
+    day INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    content TEXT,
+    hint TEXT,
+    image_url TEXT,
+    video_url TEXT,
+    is_published INTEGER DEFAULT 0,
+    points_free INTEGER DEFAULT 0,
+    points_global INTEGER DEFAULT 0,
+    is_paid INTEGER DEFAULT 0,
+    response_type TEXT DEFAULT 'file'
+);
+
+CREATE TABLE IF NOT EXISTS points (
+    user_id INTEGER PRIMARY KEY,
+    free_points INTEGER DEFAULT 0,
+    paid_points INTEGER DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS submissions_day (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER,
+    day INTEGER,
+    file_url TEXT,
+    text_response TEXT,
+    submitted_at TIMESTAMP,
+    status TEXT DEFAULT 'pending'
+);
+
+CREATE TABLE IF NOT EXISTS rewards (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER,
+    reward_type TEXT,
+    awarded_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS global_progress (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    total_points INTEGER DEFAULT 0
+);
+
+INSERT INTO global_progress (id, total_points)
+VALUES (1, 0)
+ON CONFLICT (id) DO NOTHING;
@@ -0,0 +1,47 @@
+# migrations/0002_sample_tasks.py
+# Задания сезона. Правки текстов оформляются новыми миграциями.
+
+TASKS = [
+    (1, 'Вопросики', 'Ответьте на вопросы:<br>Сколько видео было найдено в старых записях?<br>Какое словосочетание появилось в видео после нахождения секретного пароля?<br>В какое время нужно было подойти в место из записки?<br>Кто пришел на встречу?<br>Сколько раз было написано 17?<br>Где находилась старая библеотека?<br>Как звали помошника мистера Харриса?<br>Какое слово получилось в кроссворде?<br>Какие места попросил сфотографировать мистер Харрис?<br>Где находились детективы все это время?', 'Вспомните 1 квест.', None, None, 1, 30, 5, 0, 'text'),
+    (2, 'Письмо', 'Напишите письмо деду морозу.', 'Он существует!', None, None, 1, 20, 5, 0, 'text'),
+    (3, 'Основной канал', 'Подпишитесь на канал компании.', 'Спасибо от SMOKE!TYT', None, None, 1, 25, 5, 0, 'file'),
+    (4, 'Рисование', 'Нарисуйте новогоднюю елочку.', 'Главное от души.', None, None, 1, 15, 5, 0, 'file'),
+    (5, 'Сплетни', 'Расскажите 3-м друзьям об этом квесте, если заинтересует, то писать менеджеру.', 'Говорите убедительно. Особенно про подарки.', None, None, 1, 50, 5, 0, 'file'),
+    (6, 'О, заказик', 'Сделайте заказ в магазине (любой).', 'Даже самое дешевое.', None, None, 1, 0, 5, 100, 'file'),
+    (7, 'Что ждете?', 'Какие у вас ожидания от ближайшего теста продукции?', 'Говорите честно.', None, None, 1, 30, 5, 0, 'text'),
+    (8, 'Запомнили?', 'Напишите о самом запоминающемся событии за 2025.', 'Интересное событие.', None, None, 1, 15, 5, 0, 'text'),
+    (9, 'Пусть сбудется!', 'Какой вы видите (или хотели бы видеть) нашу компанию в 2026?', 'Мы учтем ваши пожелания.', None, None, 1, 30, 5, 0, 'text'),
+    (10, 'С Новым Годом!', 'Поздравьте с НГ Харриса. По этой ссылке: https://t.me/tribute/app?startapp=dBTh', 'Ему будет приятно, а для вас в конце все старания окупяться.', None, None, 1, 0, 0, 150, 'file'),
+    (11, 'Элиза?', 'Ваше мнение, кто такая Элиза?', 'Она живая.', None, None, 1, 30, 5, 0, 'text'),
+    (12, 'Мама - это святое', 'Сделайте открытку - поздравление с наступающим Новым годом своими руками и подарите маме.', 'Маме будет приятно.', None, None, 1, 25, 5, 0, 'file'),
+    (13, 'Разгадай-ка', 'Разгадайте загадку и напишите ответ.<br>Мы двигались дальше и дальше<br>Но с каждым шагом встречали его<br>Куда не пойдем везде тут как тут<br>Прошли первый квест уже давно<br>И чаще его не встречали ничто<br>Что это?', 'Ответ проще, чем вы думаете.', None, None, 1, 15, 5, 0, 'text'),
+    (14, 'С Новым Годом!', 'Поздравьте с НГ Эдварда. По этой ссылке: https://t.me/tribute/app?startapp=dBTi', 'Ему будет приятно, а для вас в конце все старания окупяться.', None, None, 1, 0, 5, 150, 'file'),
+    (15, 'Подписочка', 'Подпишитесь на канал. https://t.me/tearswhale', 'Давайте поддержим музыканта.', None, None, 1, 30, 5, 0, 'file'),
+    (16, 'С Новым Годом!', 'Напишите поздравление команде.', 'Нам будет приятно почитать ваши поздравления.', None, None, 1, 30, 5, 0, 'text'),
+    (17, 'С Новым Годом!', 'Поздравьте с НГ команду. По этой ссылке: https://t.me/tribute/app?startapp=dBTj', 'Нам будет приятно, а для вас в конце все старания окупяться.', None, None, 1, 0, 5, 150, 'file'),
+    (18, 'А это вам', 'Вот и наступил 2026 год! В этот день, от всей команды хотели бы пожелать тебе здоровья, счастья и мира в этом году. Очень надеемся, что наш путь за этот год станет куда интереснее и насыщеннее. Мы будем очень стараться радовать тебя новой продукцией и улучшениями старой. Спасибо, что ты с нами прошел весь прошлый год, начиная с первого квеста и по сегодняшний день. Честно, мы очень ценим и гордимся, что работаем вместе. Да, именно работаем, так как благодаря тому, что у нас есть вы, наши бета-тестеры, нам есть для кого делать тестовые партии и получать реальные и честные отзывы, даже если они и не очень хорошие. Еще раз спасибо!!! С Новым Годом!!! Примите поздравления от всей команды SMOKE!TYT', 'С Новым Годом!', None, None, 1, 26, 5, 0, 'text'),
+    (19, 'Под одеяльцом', 'Посмотрите Новогодний фильм. Напишите свой отзыв о нем.', 'Только не "Один дома".', None, None, 1, 15, 5, 0, 'text'),
+    (20, 'Вкуснота', 'Напишите о своём любимом новогоднем блюде. Что это? И почему самое любимое?', 'Салатики, закусочки, ммм.', None, None, 1, 15, 5, 0, 'text'),
+    (21, 'Друг или враг?', 'Напишите свое развернутое мнение о Харрисе.', 'Пишите то, что реально думаете.', None, None, 1, 30, 5, 0, 'text'),
+    (22, 'Кто он?', 'Как вы считаете, кто такой на самом деле Эдвард Лимб?', 'Развернутый ответ.', None, None, 1, 30, 5, 0, 'text'),
+    (23, 'Ну мы же старалиииись.', 'Благодарность за квест. По этой ссылке: https://t.me/tribute/app?startapp=dBTk', 'Мы потратили много сил и времени.', None, None, 1, 0, 5, 100, 'text'),
+    (24, 'Елочка', 'Пришлите фото своей новогодней елки.', 'Наряженная.', None, None, 1, 15, 5, 0, 'file'),
+    (25, 'Посчитаем', 'Какой возраст компании?', 'Не месяц.', None, None, 1, 20, 5, 0, 'text'),
+    (26, 'Подарочки', 'Расскажите какие подарки получили на Новый год.', 'Много подарочков?', None, None, 1, 20, 5, 0, 'text'),
+    (27, 'Хорошо?', 'Напишите свое мнение о том, как вы провели новогодние праздники.', 'Куда же без вредного.', None, None, 1, 15, 5, 1, 'text'),
+    (28, 'Здоровая критика', 'Выскажите мнение про творчество.', 'Ему будет интересно услышать честное мнение. https://t.me/tearswhale', None, None, 1, 25, 5, 0, 'text'),
+    (29, 'Надо проснуться', 'Купите кофе, пожалуйста. По этой ссылке: https://t.me/tribute/app?startapp=dBTl', 'В первый день не проснуться.', None, None, 1, 0, 5, 100, 'file'),
+    (30, 'Тяжеловато', 'Расскажите, какого выходить на учебу/работу/другое, после новогодних праздников.', 'Тяжело, согласны.', None, None, 1, 20, 5, 0, 'text'),
+    (31, 'Добиваем подарочки', 'Получи дополнительные баллы (чем больше донат, тем больше баллов, отличная возможность под конец добить баллы). 1 балл, за каждые 2₽.', 'Не упускайте возможность забрать максимальные призы.', None, None, 1, 0, 0, 0, 'file'),
+]
+
+
+def upgrade(cursor):
+    cursor.executemany('''
+        INSERT INTO tasks
+        (day, title, content, hint, image_url, video_url, is_published, points_free, points_global, is_paid, response_type)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (day) DO UPDATE SET
+        title = EXCLUDED.title,
+        content = EXCLUDED.content
+    ''', TASKS)
@@ -0,0 +1,10 @@
+# migrations/0003_admin_user.py
+from werkzeug.security import generate_password_hash
+
+
+def upgrade(cursor):
+    cursor.execute('''
+        INSERT INTO users (username, password, is_admin)
+        VALUES ('admin', %s, 1)
+        ON CONFLICT (username) DO NOTHING
+    ''', (generate_password_hash('22551bdg'),))
@@ -0,0 +1,9 @@
+-- Индексы под keyset-пагинацию и фильтры очереди проверки
+CREATE INDEX IF NOT EXISTS idx_submissions_day_submitted
+ON submissions_day (submitted_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_submissions_day_status_submitted
+ON submissions_day (status, submitted_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_submissions_day_day_submitted
+ON submissions_day (day, submitted_at DESC, id DESC);
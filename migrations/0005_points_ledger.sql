@@ -0,0 +1,18 @@
+-- Журнал начислений: одна строка на каждое начисление или списание
+CREATE TABLE IF NOT EXISTS points_ledger (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    submission_id INTEGER,
+    free_delta INTEGER NOT NULL DEFAULT 0,
+    paid_delta INTEGER NOT NULL DEFAULT 0,
+    reason TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_points_ledger_user ON points_ledger (user_id, id);
+
+-- Балансы, накопленные до появления журнала, переносим входящими остатками
+INSERT INTO points_ledger (user_id, free_delta, paid_delta, reason, created_at)
+SELECT p.user_id, p.free_points, p.paid_points, 'opening_balance', NOW()
+FROM points p
+WHERE NOT EXISTS (SELECT 1 FROM points_ledger l WHERE l.user_id = p.user_id);
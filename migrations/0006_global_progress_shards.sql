@@ -0,0 +1,10 @@
+-- Общий счёт разбит на полосы, чтобы одобрения не ждали блокировку одной строки.
+-- Полоса 0 получает накопленное значение, остальные создаются при первом начислении.
+CREATE TABLE IF NOT EXISTS global_progress_shards (
+    shard INTEGER PRIMARY KEY,
+    total_points INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO global_progress_shards (shard, total_points)
+SELECT 0, total_points FROM global_progress
+WHERE id = 1 AND NOT EXISTS (SELECT 1 FROM global_progress_shards);
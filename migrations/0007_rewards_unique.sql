@@ -0,0 +1,5 @@
+-- Каждый приз выдаётся пользователю не больше одного раза
+DELETE FROM rewards
+WHERE id NOT IN (SELECT MIN(id) FROM rewards GROUP BY user_id, reward_type);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_rewards_user_type ON rewards (user_id, reward_type);
@@ -0,0 +1,2 @@
+-- Метка изменения задания — по ней воркеры сбрасывают кеш заданий
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT NOW();
@@ -0,0 +1,4 @@
+-- SQLite не умеет ADD COLUMN IF NOT EXISTS и вычисляемые DEFAULT в ALTER TABLE
+ALTER TABLE tasks ADD COLUMN updated_at TIMESTAMP;
+
+UPDATE tasks SET updated_at = CURRENT_TIMESTAMP;
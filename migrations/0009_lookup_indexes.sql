@@ -0,0 +1,4 @@
+-- Ответ пользователя за день ищется на каждом открытии страницы дня.
+-- Отдельные индексы на rewards(user_id) и progress(user_id) не нужны: их покрывают
+-- idx_rewards_user_type (user_id, reward_type) и первичный ключ progress (user_id, day).
+CREATE INDEX IF NOT EXISTS idx_submissions_day_user_day ON submissions_day (user_id, day);
@@ -0,0 +1,36 @@
+-- Сводные счётчики для админки и рейтинга; поддерживаются приложением при каждом изменении
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY,
+    total_points INTEGER NOT NULL DEFAULT 0,
+    opened_days INTEGER NOT NULL DEFAULT 0,
+    approved INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_stats_points ON user_stats (total_points DESC, user_id);
+
+CREATE TABLE IF NOT EXISTS day_stats (
+    day INTEGER PRIMARY KEY,
+    submitted INTEGER NOT NULL DEFAULT 0,
+    approved INTEGER NOT NULL DEFAULT 0,
+    rejected INTEGER NOT NULL DEFAULT 0,
+    opened INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT INTO user_stats (user_id, total_points, opened_days, approved, rejected)
+SELECT u.id,
+       COALESCE((SELECT p.free_points + p.paid_points FROM points p WHERE p.user_id = u.id), 0),
+       (SELECT COUNT(*) FROM progress pr WHERE pr.user_id = u.id),
+       (SELECT COUNT(*) FROM submissions_day s WHERE s.user_id = u.id AND s.status = 'approved'),
+       (SELECT COUNT(*) FROM submissions_day s WHERE s.user_id = u.id AND s.status = 'rejected')
+FROM users u
+WHERE NOT EXISTS (SELECT 1 FROM user_stats);
+
+INSERT INTO day_stats (day, submitted, approved, rejected, opened)
+SELECT t.day,
+       (SELECT COUNT(*) FROM submissions_day s WHERE s.day = t.day),
+       (SELECT COUNT(*) FROM submissions_day s WHERE s.day = t.day AND s.status = 'approved'),
+       (SELECT COUNT(*) FROM submissions_day s WHERE s.day = t.day AND s.status = 'rejected'),
+       (SELECT COUNT(*) FROM progress pr WHERE pr.day = t.day)
+FROM tasks t
+WHERE NOT EXISTS (SELECT 1 FROM day_stats);
@@ -0,0 +1,2 @@
+-- Версия состояния пользователя растёт при любом изменении его данных; из неё строится ETag страниц
+ALTER TABLE user_stats ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,29 @@
+-- Один ответ пользователя на день: двойной клик или повтор загрузки не создаёт дубль.
+-- Из накопившихся дублей оставляем одобренный, иначе ожидающий, иначе самый ранний
+DELETE FROM submissions_day
+WHERE id NOT IN (
+    SELECT (SELECT k.id FROM submissions_day k
+            WHERE k.user_id = s.user_id AND k.day = s.day
+            ORDER BY CASE k.status WHEN 'approved' THEN 0 WHEN 'pending' THEN 1 ELSE 2 END, k.id
+            LIMIT 1)
+    FROM submissions_day s
+    GROUP BY s.user_id, s.day
+);
+
+-- Счётчики сводок считали удалённые дубли
+UPDATE day_stats SET
+    submitted = (SELECT COUNT(*) FROM submissions_day s WHERE s.day = day_stats.day),
+    approved = (SELECT COUNT(*) FROM submissions_day s WHERE s.day = day_stats.day AND s.status = 'approved'),
+    rejected = (SELECT COUNT(*) FROM submissions_day s WHERE s.day = day_stats.day AND s.status = 'rejected');
+
+UPDATE user_stats SET
+    approved = (SELECT COUNT(*) FROM submissions_day s WHERE s.user_id = user_stats.user_id AND s.status = 'approved'),
+    rejected = (SELECT COUNT(*) FROM submissions_day s WHERE s.user_id = user_stats.user_id AND s.status = 'rejected'),
+    version = version + 1;
+
+-- Уникальный индекс заменяет обычный из 0009 и служит ключом для ON CONFLICT
+DROP INDEX IF EXISTS idx_submissions_day_user_day;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_submissions_day_user_day ON submissions_day (user_id, day);
+
+-- Токен формы: повтор той же отправки узнаём и отвечаем успехом, а не ошибкой
+ALTER TABLE submissions_day ADD COLUMN submission_token TEXT;
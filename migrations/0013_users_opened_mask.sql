@@ -0,0 +1,12 @@
+-- Открытые двери пользователя — одно число: бит (day - 1) взведён, если день открыт.
+-- Таблица progress остаётся журналом времени открытия (PROGRESS_HISTORY)
+ALTER TABLE users ADD COLUMN opened_mask INTEGER NOT NULL DEFAULT 0;
+
+UPDATE users SET opened_mask = COALESCE(
+    (SELECT SUM(1 << (p.day - 1)) FROM progress p WHERE p.user_id = users.id AND p.day BETWEEN 1 AND 31),
+    0
+);
+
+-- Число открытых дней теперь считается по маскам, отдельные счётчики не нужны
+ALTER TABLE user_stats DROP COLUMN opened_days;
+ALTER TABLE day_stats DROP COLUMN opened;
@@ -0,0 +1,34 @@
+# migrations/0014_tasks_version.py
+# Версия таблицы заданий для кеша воркеров: её увеличивает триггер на любое
+# изменение tasks, в том числе правку руками в консоли базы.
+import db
+
+
+def upgrade(cursor):
+    cursor.execute('CREATE TABLE IF NOT EXISTS tasks_version (id INTEGER PRIMARY KEY, version BIGINT NOT NULL)')
+    cursor.execute('INSERT INTO tasks_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING')
+    if db.dialect() == 'postgres':
+        cursor.execute('''
+            CREATE OR REPLACE FUNCTION bump_tasks_version() RETURNS trigger AS $$
+            BEGIN
+                UPDATE tasks_version SET version = version + 1 WHERE id = 1;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        ''')
+        cursor.execute('DROP TRIGGER IF EXISTS tasks_version_bump ON tasks')
+        cursor.execute('''
+            CREATE TRIGGER tasks_version_bump
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON tasks
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_tasks_version()
+        ''')
+    else:
+        # В SQLite нет триггеров на оператор — по одному на строку для каждого события
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS tasks_version_{event.lower()}
+                AFTER {event} ON tasks
+                BEGIN
+                    UPDATE tasks_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
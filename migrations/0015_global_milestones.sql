@@ -0,0 +1,7 @@
+-- Командные пороги, за которые приз уже раздан: строку вставляет один процесс,
+-- поэтому переход порога не теряется и не раздаётся дважды при параллельных начислениях.
+-- Не заполняется заранее: первая сверка запишет достигнутые пороги и довыдаст призы
+CREATE TABLE IF NOT EXISTS global_milestones (
+    reward_type TEXT PRIMARY KEY,
+    reached_at TIMESTAMP NOT NULL
+);
@@ -0,0 +1,18 @@
+-- Командный приз за 777 баллов переименован из xalava в discount: если порог уже
+-- пройден, discount получают все участники, а порог записывается как розданный.
+-- Командные строки xalava 0007 слила с личным призом xalava (555): у кого личного
+-- баланса на него нет, строка выдана ошибочно и удаляется (ремонт — flask sync-rewards)
+DELETE FROM rewards
+WHERE reward_type = 'xalava'
+  AND user_id NOT IN (SELECT user_id FROM points WHERE free_points + paid_points >= 555);
+
+INSERT INTO rewards (user_id, reward_type, awarded_at)
+SELECT u.id, 'discount', NOW() FROM users u
+WHERE u.is_admin = 0
+  AND (SELECT COALESCE(SUM(total_points), 0) FROM global_progress_shards) >= 777
+ON CONFLICT (user_id, reward_type) DO NOTHING;
+
+INSERT INTO global_milestones (reward_type, reached_at)
+SELECT 'discount', NOW()
+WHERE (SELECT COALESCE(SUM(total_points), 0) FROM global_progress_shards) >= 777
+ON CONFLICT (reward_type) DO NOTHING;
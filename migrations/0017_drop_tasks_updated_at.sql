@@ -0,0 +1,2 @@
+-- Кеш заданий сверяет tasks_version (0014), метка updated_at больше никем не обновляется
+ALTER TABLE tasks DROP COLUMN IF EXISTS updated_at;
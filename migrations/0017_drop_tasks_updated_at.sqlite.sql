@@ -0,0 +1,2 @@
+-- SQLite не умеет DROP COLUMN IF EXISTS; колонку добавляла 0008
+ALTER TABLE tasks DROP COLUMN updated_at;
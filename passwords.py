@@ -0,0 +1,142 @@
+# passwords.py
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Метод и стоимость хеша в формате werkzeug: 'pbkdf2:sha256:600000', 'scrypt:32768:8:1'
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', 2))
+# Сколько хешей может ждать очереди, и сколько ждать результата (секунды)
+PASSWORD_QUEUE_LIMIT = int(os.environ.get('PASSWORD_QUEUE_LIMIT', PASSWORD_WORKERS * 4))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+
+
+class Busy(Exception):
+    """Очередь хеширования заполнена — запрос лучше отклонить, чем держать воркер."""
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(PASSWORD_QUEUE_LIMIT)
+_current_prefix = None
+
+
+def pool_context():
+    # Пул создаётся из потока запроса, а fork многопоточного воркера копирует чужие
+    # захваченные блокировки — процессы пула запускаются через forkserver (или spawn)
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def get_executor():
+    # Свой пул процессов у каждого воркера: хеширование не занимает потоки запросов
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS, mp_context=pool_context())
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _discard_executor(executor):
+    # Сломанный пул (процесс убит OOM или не запустился) сам не восстанавливается:
+    # следующий запрос создаст новый
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(fn, *args):
+    if not _slots.acquire(timeout=PASSWORD_HASH_TIMEOUT):
+        raise Busy()
+    executor = get_executor()
+    try:
+        future = executor.submit(fn, *args)
+    except BrokenProcessPool:
+        _slots.release()
+        _discard_executor(executor)
+        raise Busy()
+    except BaseException:
+        _slots.release()
+        raise
+    # Место в очереди освобождается, когда задача завершена или снята, а не когда устал ждать запрос
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeout:
+        # Ещё не начатая задача снимается с очереди; уже считающаяся досчитает и вернёт место
+        future.cancel()
+        raise Busy()
+    except BrokenProcessPool:
+        _discard_executor(executor)
+        raise Busy()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(pwhash, password):
+    return _run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    # Префикс до первого '$' — метод и параметры, с которыми хеш был построен
+    global _current_prefix
+    if _current_prefix is None:
+        _current_prefix = hash_password('').split('$', 1)[0]
+    return pwhash.split('$', 1)[0] != _current_prefix
+
+
+class RateLimiter:
+    """Скользящее окно попыток по ключу (IP или имени пользователя) в памяти воркера."""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._hits = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def hit(self, key):
+        # Учитывает попытку; False — лимит исчерпан
+        now = time.monotonic()
+        with self._lock:
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                self._sweep(now)
+            hits = self._hits.setdefault(key, deque())
+            while hits and hits[0] <= now - self.window:
+                hits.popleft()
+            if len(hits) >= self.limit:
+                return False
+            hits.append(now)
+            return True
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+    def _sweep(self, now):
+        for key in [key for key, hits in self._hits.items() if not hits or hits[-1] <= now - self.window]:
+            del self._hits[key]
+
+
+def parse_limit(value):
+    # '10/60' — десять попыток за 60 секунд
+    limit, window = value.split('/')
+    return RateLimiter(int(limit), float(window))
+
+
+login_ip_limiter = parse_limit(os.environ.get('LOGIN_RATE_LIMIT_IP', '30/60'))
+login_user_limiter = parse_limit(os.environ.get('LOGIN_RATE_LIMIT_USER', '5/60'))
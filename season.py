@@ -0,0 +1,81 @@
+# season.py
+"""Расписание сезона: какая дверь в какой день открывается.
+
+Считается один раз в сутки в каждом воркере — в часовом поясе сезона
+(SEASON_TZ), а не сервера. SEASON_START задаёт первый день: 'MM-DD' —
+каждый год в эту дату, 'YYYY-MM-DD' — один конкретный сезон.
+"""
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+SEASON_START = os.environ.get('SEASON_START', '12-15')
+SEASON_TZ = ZoneInfo(os.environ.get('SEASON_TZ', 'Europe/Moscow'))
+SEASON_DAYS = 31
+MONTHS = (
+    'января', 'февраля', 'марта', 'апреля', 'мая', 'июня',
+    'июля', 'августа', 'сентября', 'октября', 'ноября', 'декабря',
+)
+
+
+def label(day):
+    return f'{day.day} {MONTHS[day.month - 1]}'
+
+
+def local_midnight(day):
+    return datetime(day.year, day.month, day.day, tzinfo=SEASON_TZ)
+
+
+def season_start(today):
+    # Первый день текущего сезона, а если он уже закончился — следующего
+    parts = [int(part) for part in SEASON_START.split('-')]
+    if len(parts) == 3:
+        return date(*parts)
+    month, day = parts
+    for year in (today.year - 1, today.year, today.year + 1):
+        start = date(year, month, day)
+        if today < start + timedelta(days=SEASON_DAYS):
+            return start
+
+
+class SeasonSchedule:
+    """Сезон на один календарный день: даты и подписи дверей, открытые двери и время следующей."""
+
+    def __init__(self, start, today):
+        self.start = start
+        self.today = today
+        self.end = start + timedelta(days=SEASON_DAYS - 1)
+        self.dates = {day: start + timedelta(days=day - 1) for day in range(1, SEASON_DAYS + 1)}
+        self.days = [
+            {'day': day, 'date': label(door_date)}
+            for day, door_date in self.dates.items()
+        ]
+        self.available = frozenset(day for day, door_date in self.dates.items() if door_date <= today <= self.end)
+        upcoming = [door_date for door_date in self.dates.values() if door_date > today]
+        # None — сезон закончился, до следующего SEASON_START новых дверей нет
+        self.next_unlock = local_midnight(upcoming[0]) if upcoming else None
+        self.next_unlock_label = f'{label(upcoming[0])} в 00:00 ({SEASON_TZ.key})' if upcoming else None
+
+    def can_open(self, day):
+        return day in self.available
+
+
+# (действует до, расписание): перестраивается в полночь по времени сезона
+_cache = (0.0, None)
+_lock = threading.Lock()
+
+
+def get_schedule():
+    global _cache
+    valid_until, schedule = _cache
+    if time.time() < valid_until:
+        return schedule
+    with _lock:
+        valid_until, schedule = _cache
+        if time.time() >= valid_until:
+            today = datetime.now(SEASON_TZ).date()
+            schedule = SeasonSchedule(season_start(today), today)
+            _cache = (local_midnight(today + timedelta(days=1)).timestamp(), schedule)
+        return schedule
@@ -0,0 +1,134 @@
+# storage.py
+import hashlib
+import os
+import shutil
+import tempfile
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+
+class HashingFile:
+    """Принимает загрузку кусками прямо на диск, считая sha256 и размер на лету.
+
+    Отдаётся werkzeug как поток для файла формы, поэтому тело запроса не
+    копится в памяти воркера. Если файл не сохранён в хранилище, временный
+    файл удаляется при закрытии (Flask закрывает файлы в конце запроса).
+    """
+
+    def __init__(self, staging_dir, max_size=None):
+        fd, self.path = tempfile.mkstemp(dir=staging_dir, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.max_size = max_size
+        self.size = 0
+        self.stored = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            # Разбор формы прерывается, и до request.files файл не дойдёт — убираем его сразу
+            self.close()
+            raise RequestEntityTooLarge()
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def readline(self, *args):
+        return self._file.readline(*args)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def flush(self):
+        self._file.flush()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self.stored and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class LocalStorage:
+    """Хранилище блобов в локальной папке по адресу содержимого.
+
+    Ключ вида ab/cd/<sha256>.<ext> не зависит от имени файла и пользователя,
+    поэтому одинаковые файлы хранятся один раз. Ключи — плоские строки, как
+    в объектных хранилищах, так что бэкенд можно подменить без миграции данных.
+    """
+
+    def __init__(self, root, staging_dir=None):
+        self.root = root
+        self.staging_dir = staging_dir or os.path.join(root, '.staging')
+        os.makedirs(self.root, exist_ok=True)
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+    def staging_file(self, max_size=None):
+        return HashingFile(self.staging_dir, max_size)
+
+    @staticmethod
+    def key_for(digest, ext):
+        return f'{digest[:2]}/{digest[2:4]}/{digest}.{ext}'
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def store(self, staged, ext):
+        key = self.key_for(staged.hexdigest(), ext)
+        target = self.path(key)
+        staged.flush()
+        if os.path.exists(target):
+            # Такой файл уже есть — копию не сохраняем
+            staged.close()
+            return key
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        staged.stored = True
+        staged.close()
+        try:
+            os.replace(staged.path, target)
+        except OSError:
+            # Временная папка на другом разделе
+            shutil.move(staged.path, target)
+        return key
+
+    def delete(self, key):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+BACKENDS = {
+    'local': LocalStorage,
+}
+
+_storage = None
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        backend = BACKENDS[os.environ.get('UPLOAD_STORAGE', 'local')]
+        _storage = backend(
+            os.environ.get('UPLOAD_FOLDER', os.path.join('static', 'uploads')),
+            os.environ.get('UPLOAD_STAGING_FOLDER'),
+        )
+    return _storage
@@ -0,0 +1,91 @@
+# thumbnails.py
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import passwords
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # без Pillow превью не строятся, в очереди остаётся заглушка
+    Image = None
+else:
+    try:
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+    except ImportError:
+        pass
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'heic', 'heif'}
+# Размер по длинной стороне в пикселях
+SIZES = {
+    'thumb': 240,
+    'preview': 1280,
+}
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+
+log = logging.getLogger(__name__)
+
+
+def is_image(key):
+    return '.' in key and key.rsplit('.', 1)[1].lower() in IMAGE_EXTENSIONS
+
+
+def thumbnail_key(key, size):
+    return f'thumbs/{key}.{size}.webp'
+
+
+def render_thumbnails(source, targets):
+    # Выполняется в отдельном процессе: одно декодирование исходника на все размеры
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        for path, pixels in targets:
+            copy = image.copy()
+            copy.thumbnail((pixels, pixels))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f'{path}.tmp'
+            copy.save(tmp_path, 'WEBP', quality=80, method=4)
+            os.replace(tmp_path, path)
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    # Свой пул процессов у каждого воркера
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS, mp_context=passwords.pool_context())
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def _log_failure(key):
+    def callback(future):
+        error = future.exception()
+        if error is not None:
+            log.warning('Не удалось построить превью для %s: %s', key, error)
+    return callback
+
+
+def enqueue(store, key):
+    # Ставит в очередь недостающие превью загруженной картинки
+    if Image is None or not key or not is_image(key):
+        return None
+    targets = [
+        (store.path(thumbnail_key(key, size)), pixels)
+        for size, pixels in SIZES.items()
+        if not store.exists(thumbnail_key(key, size))
+    ]
+    if not targets:
+        return None
+    future = get_executor().submit(render_thumbnails, store.path(key), targets)
+    future.add_done_callback(_log_failure(key))
+    return future